@@ -0,0 +1,267 @@
+"""
+End to end benchmark of the events gateway.
+
+Starts the application with `make_app` on a local port using the
+in-memory queue backend, opens websocket clients that authenticate
+with signed tokens and subscribe to routing keys picked from a
+uniform or skewed distribution, then injects events through the
+queue and measures their delivery.
+
+Clients run in the same process and event loop as the server, so
+memory per connection and CPU per message include the client side
+of each connection. Numbers are meant to be compared between runs
+on the same machine, not taken as absolute.
+
+Usage:
+
+    python -m benchmarks.bench_e2e [-c CONNECTIONS] [-k KEYS] [-m MESSAGES]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+
+from tornado.netutil import bind_sockets
+from tornado.websocket import websocket_connect
+
+from taiga_events import main
+from taiga_events import signing
+from taiga_events import websocket
+from taiga_events.queues import base
+
+SECRET_KEY = "mysecret"
+PROJECT_ID = 1
+
+
+def _wait(tornado_future) -> asyncio.Future:
+    """
+    Wrap a tornado future so it can be used from coroutines.
+    """
+    future = asyncio.Future()
+
+    def done(f):
+        if f.exception() is not None:
+            future.set_exception(f.exception())
+        else:
+            future.set_result(f.result())
+
+    tornado_future.add_done_callback(done)
+    return future
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Peak instead of current resident size, in KiB on linux
+        # and bytes on OS X.
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _percentile(values:list, percent:float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def make_keys(count:int) -> list:
+    return ["changes.project.{0}.userstories.{1}".format(PROJECT_ID, x) for x in range(count)]
+
+
+def pick_key(keys:list, distribution:str, rand:random.Random) -> str:
+    if distribution == "zipf":
+        # Few hot keys, long tail of cold ones
+        index = int(rand.paretovariate(1.2)) - 1
+        return keys[min(index, len(keys) - 1)]
+    return rand.choice(keys)
+
+
+def pick_keys(keys:list, count:int, distribution:str, rand:random.Random) -> list:
+    picked = set()
+    while len(picked) < min(count, len(keys)):
+        picked.add(pick_key(keys, distribution, rand))
+    return list(picked)
+
+
+class Client(object):
+    def __init__(self, url:str, number:int):
+        self.url = url
+        self.number = number
+        self.received = 0
+        self.latencies = []
+        self.conn = None
+
+    @asyncio.coroutine
+    def connect(self, routing_keys:list):
+        self.conn = yield from _wait(websocket_connect(self.url))
+
+        token = signing.dumps({"user_authentication_id": self.number}, key=SECRET_KEY)
+        self.conn.write_message(json.dumps({"cmd": "auth",
+                                            "data": {"token": token,
+                                                     "sessionId": str(self.number)}}))
+        for routing_key in routing_keys:
+            self.conn.write_message(json.dumps({"cmd": "subscribe",
+                                                "routing_key": routing_key}))
+
+    @asyncio.coroutine
+    def run(self):
+        while True:
+            message = yield from _wait(self.conn.read_message())
+            if message is None:
+                return
+
+            received_at = time.monotonic()
+            data = json.loads(message)
+            if "ts" in data:
+                self.received += 1
+                self.latencies.append(received_at - data["ts"])
+
+
+@asyncio.coroutine
+def _wait_for(condition, timeout:float, tick:float=0.01) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        yield from asyncio.sleep(tick)
+    return True
+
+
+def _dropped() -> int:
+    return sum(base.overflow_stats.values()) + websocket.overflow_stats["dropped_messages"]
+
+
+@asyncio.coroutine
+def run(args):
+    config = dict(main.DEFAULT_CONFIG)
+    config.update({
+        "debug": False,
+        "secret_key": SECRET_KEY,
+        "queue_conf": {"path": "taiga_events.queues.memory.EventsQueue", "kwargs": {}},
+        "repo_conf": {"kwargs": {"dsn": "dbname=unused"}, "pool": {"minsize": 0}},
+        "outbound_conf": {"max_messages": args.buffer},
+    })
+
+    app = main.make_app(config)
+    hub = app.settings["hub"]
+    queue = hub.queues
+
+    # All users are members of the benchmark project, so
+    # subscriptions are authorized without the database.
+    for number in range(args.connections):
+        app.settings["memberships"].cache.set(number, frozenset([PROJECT_ID]))
+
+    yield from main.warm_app(app)
+
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    main.start_app(app, sockets=sockets, join=False)
+
+    rand = random.Random(args.seed)
+    keys = make_keys(args.keys)
+    url = "ws://127.0.0.1:{0}/events".format(port)
+    clients = [Client(url, number) for number in range(args.connections)]
+
+    rss_before = _rss_bytes()
+    connect_started = time.monotonic()
+
+    for index in range(0, len(clients), args.concurrency):
+        chunk = clients[index:index + args.concurrency]
+        yield from asyncio.wait([c.connect(pick_keys(keys, args.subscriptions,
+                                                     args.distribution, rand))
+                                 for c in chunk])
+
+    subscriptions = args.connections * min(args.subscriptions, args.keys)
+    if not (yield from _wait_for(lambda: hub.subscribers_total >= subscriptions, 60)):
+        print("Only {0} of {1} subscriptions were opened".format(
+              hub.subscribers_total, subscriptions), file=sys.stderr)
+
+    connect_elapsed = time.monotonic() - connect_started
+    rss_after = _rss_bytes()
+
+    readers = [asyncio.Task(c.run()) for c in clients]
+
+    expected = 0
+    dropped_before = _dropped()
+    padding = "x" * args.payload_size
+    cpu_started = time.process_time()
+    started = time.monotonic()
+
+    for number in range(args.messages):
+        routing_key = pick_key(keys, args.distribution, rand)
+        expected += hub.subscribers_count(routing_key)
+        queue.publish(routing_key, json.dumps({"pk": number, "ts": time.monotonic(),
+                                               "data": padding}))
+
+        # Let the loop deliver after each burst
+        if (number + 1) % args.burst == 0:
+            if args.rate:
+                yield from asyncio.sleep(args.burst / args.rate)
+            else:
+                yield from asyncio.sleep(0)
+
+    # Dropped messages will never be received
+    received = lambda: sum(c.received for c in clients)
+    dropped = lambda: _dropped() - dropped_before
+    yield from _wait_for(lambda: received() + dropped() >= expected, args.timeout)
+
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu_started
+    delivered = received()
+    latencies = sorted(l for c in clients for l in c.latencies)
+
+    for c in clients:
+        c.conn.close()
+    for reader in readers:
+        reader.cancel()
+
+    print("connections:            {0} ({1:.2f}s to connect)".format(args.connections,
+                                                                    connect_elapsed))
+    print("subscriptions:          {0} over {1} keys ({2})".format(subscriptions, args.keys,
+                                                                  args.distribution))
+    print("messages published:     {0}".format(args.messages))
+    print("deliveries:             {0} of {1} expected".format(delivered, expected))
+    print("dropped:                {0}".format(dropped()))
+    print("throughput:             {0:.0f} deliveries/sec".format(delivered / elapsed))
+    print("latency p50:            {0:.2f} ms".format(_percentile(latencies, 50) * 1000))
+    print("latency p99:            {0:.2f} ms".format(_percentile(latencies, 99) * 1000))
+    print("memory per connection:  {0:.1f} KiB".format(
+          (rss_after - rss_before) / args.connections / 1024))
+    print("cpu per delivery:       {0:.1f} us".format(cpu / max(delivered, 1) * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End to end events gateway benchmark.")
+    parser.add_argument("-c", "--connections", dest="connections", type=int, default=1000,
+                        help="Websocket clients to open.")
+    parser.add_argument("-s", "--subscriptions", dest="subscriptions", type=int, default=1,
+                        help="Subscriptions per client.")
+    parser.add_argument("-k", "--keys", dest="keys", type=int, default=50,
+                        help="Distinct routing keys.")
+    parser.add_argument("-d", "--distribution", dest="distribution", default="uniform",
+                        choices=["uniform", "zipf"], help="Routing keys distribution.")
+    parser.add_argument("-m", "--messages", dest="messages", type=int, default=10000,
+                        help="Messages to publish.")
+    parser.add_argument("-r", "--rate", dest="rate", type=float, default=0,
+                        help="Messages per second, 0 to publish as fast as possible.")
+    parser.add_argument("-b", "--burst", dest="burst", type=int, default=10,
+                        help="Messages published between loop iterations.")
+    parser.add_argument("--payload-size", dest="payload_size", type=int, default=200,
+                        help="Bytes of padding in every message.")
+    parser.add_argument("--buffer", dest="buffer", type=int, default=1000,
+                        help="Outbound buffer size per connection, in messages.")
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=100,
+                        help="Clients connecting at the same time.")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=30,
+                        help="Seconds to wait for pending deliveries.")
+    parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
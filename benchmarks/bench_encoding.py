@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of the wire encodings.
+
+Compares bytes on the wire and CPU per delivered message for a
+message received from upstream and fanned out to `recipients`
+subscribers of one routing key, for JSON text frames and for
+MessagePack binary frames with JSON and packed upstream payloads.
+
+Needs the msgpack package.
+
+Usage:
+
+    python -m benchmarks.bench_encoding [-n NUMBER] [-r RECIPIENTS]
+"""
+
+import argparse
+import json
+import timeit
+
+import msgpack
+
+from taiga_events.messages import Message
+
+ROUTING_KEY = "changes.project.1.userstories"
+
+DATA = {
+    "session_id": "0123456789abcdef",
+    "matches": "userstories.userstory",
+    "pk": 4242,
+    "type": "change",
+    "data": {"subject": "As a user I want to drag cards " * 4,
+             "tags": ["backend", "frontend", "ux"],
+             "points": {"1": 3, "2": 5, "3": 8},
+             "is_closed": False,
+             "kanban_order": 1434567890,
+             "assigned_to": None},
+}
+
+
+def deliver(payload, recipients:int, binary:bool) -> int:
+    msg = Message(payload)
+    size = 0
+    for x in range(recipients):
+        if binary:
+            size = len(msg.binary_frame(ROUTING_KEY).data)
+        else:
+            size = len(msg.frame(ROUTING_KEY).data)
+    return size
+
+
+def run(number:int, recipients:int):
+    json_payload = json.dumps(DATA)
+    packed_payload = msgpack.packb(DATA, use_bin_type=True)
+
+    cases = [
+        ("json", json_payload, False),
+        ("msgpack (json upstream)", json_payload, True),
+        ("msgpack (passthrough)", packed_payload, True),
+    ]
+
+    print("{0:<26} {1:>8} {2:>18}".format("encoding", "bytes", "us/delivery"))
+    for name, payload, binary in cases:
+        size = deliver(payload, recipients, binary)
+        elapsed = min(timeit.repeat(lambda: deliver(payload, recipients, binary),
+                                    number=number, repeat=3))
+        print("{0:<26} {1:>8} {2:>18.3f}".format(
+              name, size, elapsed / number / recipients * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wire encodings micro-benchmark.")
+    parser.add_argument("-n", "--number", dest="number", type=int, default=20000,
+                        help="Messages per measure.")
+    parser.add_argument("-r", "--recipients", dest="recipients", type=int, default=1,
+                        help="Subscribers receiving every message.")
+    args = parser.parse_args()
+    run(args.number, args.recipients)
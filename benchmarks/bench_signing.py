@@ -0,0 +1,37 @@
+"""
+Micro-benchmark of token signing and verification.
+
+Usage:
+
+    python -m benchmarks.bench_signing [-n NUMBER]
+"""
+
+import argparse
+import timeit
+
+from taiga_events import signing
+
+SECRET_KEY = "mysecret"
+
+
+def run(number:int):
+    token = signing.dumps({"user_authentication_id": 1}, key=SECRET_KEY)
+    signer = signing.TimestampSigner(SECRET_KEY, salt="django.core.signing")
+
+    cases = [
+        ("signing.dumps", lambda: signing.dumps({"user_authentication_id": 1}, key=SECRET_KEY)),
+        ("signing.loads", lambda: signing.loads(token, key=SECRET_KEY)),
+        ("TimestampSigner.unsign", lambda: signer.unsign(token)),
+    ]
+
+    for name, fn in cases:
+        elapsed = min(timeit.repeat(fn, number=number, repeat=3))
+        print("{0:<24} {1:>12.0f} ops/sec".format(name, number / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Signing micro-benchmark.")
+    parser.add_argument("-n", "--number", dest="number", type=int, default=20000,
+                        help="Operations per measure.")
+    args = parser.parse_args()
+    run(args.number)
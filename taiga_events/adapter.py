@@ -1,5 +1,6 @@
 import asyncio
 from tornado import websocket as tws
+from tornado.iostream import StreamClosedError
 
 from . import types
 from . import websocket as ws
@@ -12,15 +13,31 @@ def adapt_handler(handler_cls):
     """
 
     class _tornado_handler_adapter(tws.WebSocketHandler):
-        def initialize(self, config):
-            self.__connection = ws.WebSocketConnection(self)
+        def initialize(self, config, **kwargs):
+            outbound_conf = config.get("outbound_conf", None) or {}
+            self.__compression = config.get("compression_conf", None)
+            self.__connection = ws.WebSocketConnection(self, **outbound_conf)
             self.__handler = handler_cls()
-            self.__handler.on_initialize(config)
+            self.__handler.on_initialize(config, **kwargs)
             super().initialize()
 
         def check_origin(self, origin):
             return True
 
+        def get_compression_options(self):
+            if self.__compression is None:
+                return None
+            return {}
+
+        def get(self, *args, **kwargs):
+            # Compressed frames are shared between connections, so
+            # they can't depend on previous messages of any of them.
+            extensions = self.request.headers.get("Sec-WebSocket-Extensions", None)
+            if extensions and self.__compression is not None:
+                self.request.headers["Sec-WebSocket-Extensions"] = \
+                    ws.force_server_no_context_takeover(extensions)
+            return super().get(*args, **kwargs)
+
         def open(self):
             self.set_nodelay(True)
             result = self.__handler.on_open(self.__connection)
@@ -32,6 +49,48 @@ def adapt_handler(handler_cls):
             if asyncio.iscoroutine(result):
                 asyncio.Task(result)
 
+        def write_frame(self, frame:ws.Frame):
+            protocol = self.ws_connection
+            if protocol is None:
+                raise tws.WebSocketClosedError()
+
+            # Connections that need their own framing (masking or
+            # compression with context takeover) can't share the
+            # frame bytes.
+            compressor = getattr(protocol, "_compressor", None)
+            if protocol.mask_outgoing or (compressor and compressor._compressor is not None):
+                if frame.binary:
+                    return self.write_message(frame.payload, binary=True)
+                return self.write_message(frame.text)
+
+            data = frame.data
+            if compressor is not None and len(data) >= self.__compression.get("min_size", 1024):
+                data = frame.deflated_data(max_wbits=compressor._max_wbits,
+                                           level=self.__compression.get("level", -1))
+
+            try:
+                protocol.stream.write(data)
+            except StreamClosedError:
+                protocol._abort()
+
+        def is_writing(self):
+            protocol = self.ws_connection
+            return protocol is not None and protocol.stream.writing()
+
+        def on_drain(self, callback):
+            """
+            Call the given callback once all buffered
+            data is written to the socket.
+            """
+            protocol = self.ws_connection
+            if protocol is None:
+                return
+
+            try:
+                protocol.stream.write(b"", callback)
+            except StreamClosedError:
+                pass
+
         def on_close(self):
             result = self.__handler.on_close(self.__connection)
             if asyncio.iscoroutine(result):
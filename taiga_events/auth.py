@@ -0,0 +1,174 @@
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import signing
+from .utils.cache import LRUCache
+
+log = logging.getLogger("taiga.auth")
+
+
+class TokenVerifier(object):
+    """
+    Verifies authentication tokens keeping a bounded
+    cache of already verified ones, so clients reconnecting
+    with the same token skip the signature checking and
+    decoding work.
+
+    Only successfully verified tokens are cached.
+    """
+
+    def __init__(self, secret_key:str, *, cache_size:int=10000, cache_ttl:float=300):
+        self.secret_key = secret_key
+        self.cache = LRUCache(cache_size, cache_ttl)
+
+    def cached(self, token:str) -> dict:
+        """
+        Return the data of an already verified
+        token or None if it is not cached.
+        """
+        return self.cache.get(token, None)
+
+    def check(self, token:str) -> dict:
+        """
+        Verify the token signature without using the cache,
+        so it is safe to call it from other threads.
+        """
+        return signing.loads(token, key=self.secret_key)
+
+    def verify(self, token:str) -> dict:
+        """
+        Return the data signed in the token. Raises
+        signing.BadSignature if it is not valid.
+        """
+        token_data = self.cached(token)
+        if token_data is None:
+            token_data = self.check(token)
+            self.cache.set(token, token_data)
+        return token_data
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def _check_batch(verifier:TokenVerifier, tokens:list) -> dict:
+    results = {}
+    for token in tokens:
+        try:
+            results[token] = (verifier.check(token), None)
+        except Exception as e:
+            results[token] = (None, e)
+    return results
+
+
+class BatchVerifier(object):
+    """
+    Auth pipeline that collects tokens pending of verification
+    for up to `max_latency` seconds or `max_batch_size` tokens
+    and verifies them in a single batch, optionally in a thread
+    pool, resolving the future of every waiting connection.
+
+    Cached tokens are resolved immediately. With a max batch
+    size of 1 every token is verified as soon as it arrives.
+    """
+
+    def __init__(self, verifier:TokenVerifier, *, max_batch_size:int=1,
+                 max_latency:float=0.005, executor=None, loop=None):
+        assert max_batch_size > 0, "batch size should be positive"
+
+        self.verifier = verifier
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.executor = executor
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = {}
+        self._pending_count = 0
+        self._timer = None
+
+    @asyncio.coroutine
+    def verify(self, token:str) -> dict:
+        token_data = self.verifier.cached(token)
+        if token_data is not None:
+            return token_data
+
+        future = asyncio.Future(loop=self._loop)
+
+        # The same token may be waiting for verification
+        # many times during a reconnection storm.
+        self._pending.setdefault(token, []).append(future)
+        self._pending_count += 1
+
+        if self._pending_count >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.max_latency, self._flush)
+
+        return (yield from future)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        stats = self.verifier.stats()
+        stats["pending"] = self._pending_count
+        return stats
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending = self._pending
+        self._pending = {}
+        self._pending_count = 0
+
+        if not pending:
+            return
+
+        tokens = list(pending)
+        if self.executor is None:
+            self._resolve(pending, _check_batch(self.verifier, tokens))
+            return
+
+        def done_callback(f):
+            try:
+                results = f.result()
+            except Exception as e:
+                log.error("Unhandled exception", exc_info=True)
+                results = {token: (None, e) for token in tokens}
+            self._resolve(pending, results)
+
+        future = self._loop.run_in_executor(self.executor, _check_batch, self.verifier, tokens)
+        future.add_done_callback(done_callback)
+
+    def _resolve(self, pending:dict, results:dict):
+        for token, futures in pending.items():
+            token_data, error = results[token]
+            if error is None:
+                self.verifier.cache.set(token, token_data)
+
+            for future in futures:
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(token_data)
+                else:
+                    future.set_exception(error)
+
+
+def make_verifier(config:dict) -> BatchVerifier:
+    auth_conf = dict(config.get("auth_conf", None) or {})
+    batch_size = auth_conf.pop("batch_size", 1)
+    batch_latency = auth_conf.pop("batch_latency", 0.005)
+    threads = auth_conf.pop("threads", 0)
+
+    executor = None
+    if threads:
+        executor = ThreadPoolExecutor(max_workers=threads)
+
+    verifier = TokenVerifier(config["secret_key"], **auth_conf)
+    return BatchVerifier(verifier, max_batch_size=batch_size,
+                         max_latency=batch_latency, executor=executor)
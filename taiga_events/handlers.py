@@ -1,12 +1,16 @@
 import asyncio
 import json
+import time
 import traceback
 import logging
 
-from . import repository as repo
-from . import signing
-from . import classloader as loader
+from . import metrics
+from . import permissions
+from . import profiling
 from . import types
+from .messages import Message
+from .utils import packing
+from .utils import topics
 from . import websocket as ws
 
 log = logging.getLogger("taiga")
@@ -37,9 +41,9 @@ def serialize_error(error:Exception) -> str:
     return serialize_data({"error": str(error)})
 
 
-def is_same_session(identity:types.AuthMsg, message:dict) -> bool:
+def is_same_session(identity:types.AuthMsg, message:Message) -> bool:
     current_session_id = identity.session_id
-    message_session_id = message.get("session_id", None)
+    message_session_id = message.session_id
 
     if message_session_id is None:
         return False
@@ -47,17 +51,19 @@ def is_same_session(identity:types.AuthMsg, message:dict) -> bool:
 
 
 class Subscription(object):
-    def __init__(self, identity, routing_key, queues, ws):
+    def __init__(self, identity, routing_key, queues, ws, *, binary:bool=False):
         self.identity = identity
         self.queues = queues
         self.routing_key = routing_key
         self.ws = ws
+        self.binary = binary
 
         self.loop = None
 
     @asyncio.coroutine
     def start(self):
-        self.loop = asyncio.Task(self._subscription_ventilator())
+        self.loop = profiling.label(asyncio.Task(self._subscription_ventilator()),
+                                    "subscription {0}", self.routing_key)
 
     @asyncio.coroutine
     def stop(self):
@@ -65,12 +71,17 @@ class Subscription(object):
             return
         self.loop.cancel()
 
+        # Wait until upstream subscription is closed
+        yield from asyncio.wait([self.loop])
+
     @asyncio.coroutine
     def _subscription_ventilator(self):
         queues = self.queues
-        sub = yield from queues.subscribe(self.routing_key)
+        sub = None
 
         try:
+            sub = yield from queues.subscribe(self.routing_key)
+
             while True:
                 msg = yield from queues.consume_message(sub)
                 log.debug("Received message for %s: [%s] - %s",
@@ -81,9 +92,22 @@ class Subscription(object):
                     yield from asyncio.sleep(0)
                     continue
 
-                msg["routing_key"] = self.routing_key
-                msg = json.dumps(msg)
-                self.ws.write(msg)
+                # Pattern subscribers receive the key the
+                # message was published with.
+                routing_key = msg.routing_key or self.routing_key
+
+                key = None
+                if msg.object_id is not None:
+                    key = (routing_key, msg.object_id)
+
+                if self.binary:
+                    frame = msg.binary_frame(routing_key)
+                else:
+                    frame = msg.frame(routing_key)
+                self.ws.write(frame, key=key)
+
+                metrics.messages_delivered.inc()
+                metrics.delivery_latency.observe(time.monotonic() - msg.received_at)
 
         except asyncio.CancelledError:
             # Raised when connection is closed from browser
@@ -106,25 +130,62 @@ class Subscription(object):
             except Exception as e:
                 log.error("Unhandled exception", exc_info=True, stack_info=False)
 
-        yield from queues.close_subscription(sub)
+        if sub is not None:
+            yield from queues.close_subscription(sub)
 
 
 class ConnectionHandler(object):
-    def __init__(self, ws, config):
+    def __init__(self, ws, config, hub, auth, memberships, connections:set):
         self.ws = ws
         self.config = config
         self.authenticated = False
+        self.closed = False
+        self.binary = False
         self.subscriptions = {}
-        self.queues = loader.load_queue_implementation(config)
+        self.queues = hub
+        self.auth = auth
+        self.memberships = memberships
+        self.connections = connections
+        self.connections.add(self)
+
+        self._inbox = asyncio.Queue()
+        self._consumer = None
+
+    def receive(self, message:dict):
+        """
+        Queue a message received from the client. Messages of
+        a connection are handled one by one in arrival order, so
+        commands sent right after auth wait for it to finish.
+        """
+        if self._consumer is None:
+            self._consumer = profiling.label(asyncio.Task(self._consume_messages()),
+                                             "handler messages from {0}", self.ws.remote_ip)
+        self._inbox.put_nowait(message)
+
+    @asyncio.coroutine
+    def _consume_messages(self):
+        while True:
+            message = yield from self._inbox.get()
+            try:
+                yield from self.add_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.error("Unhandled exception", exc_info=True, stack_info=False)
 
     @asyncio.coroutine
     def close(self):
+        self.closed = True
+        self.connections.discard(self)
+
+        if self._consumer is not None:
+            self._consumer.cancel()
+
         # Closed all subscriptions
-        for name, item in self.subscriptions.items():
+        subscriptions, self.subscriptions = self.subscriptions, {}
+        for name, item in subscriptions.items():
             yield from item.stop()
 
-        # self.queues.close_all_connections()
-
     @asyncio.coroutine
     def parse_auth_message(self, message:dict) -> types.AuthMsg:
         """
@@ -134,19 +195,109 @@ class ConnectionHandler(object):
         assert "token" in message, "handshake message should contain token"
         assert "sessionId" in message, "handshake message should contain sessionId"
 
-        token_data = signing.loads(message["token"], key=self.config["secret_key"])
+        token_data = yield from self.auth.verify(message["token"])
         return types.AuthMsg(message["token"], token_data["user_authentication_id"], message["sessionId"])
 
     @asyncio.coroutine
     def authenticate(self, message:dict):
         log.debug("Authenticating peer %s with: %s", self.ws.remote_ip, message)
-        self.identity = yield from self.parse_auth_message(message)
+
+        started_at = time.monotonic()
+        try:
+            self.identity = yield from self.parse_auth_message(message)
+        finally:
+            metrics.auth_latency.observe(time.monotonic() - started_at)
+
+        self.negotiate_encoding(message.get("encoding", None))
+        self.negotiate_batching(message.get("batch", None))
+
+    def negotiate_encoding(self, encoding:str):
+        """
+        Clients may ask in the auth message to receive events
+        as MessagePack binary frames with `{"encoding": "msgpack"}`.
+        Other messages are still sent as JSON text frames.
+        """
+        if encoding is None or encoding == "json":
+            return
+
+        if encoding == "msgpack" and packing.is_available():
+            self.binary = True
+            return
+
+        log.warning("Encoding %s not supported for %s", encoding, self.ws.remote_ip)
+        self.ws.write(serialize_data({"error": "Encoding not supported",
+                                      "encoding": encoding}))
+
+    def negotiate_batching(self, options):
+        """
+        Clients may ask in the auth message to receive events
+        bundled in JSON arrays, with `{"batch": true}` or
+        `{"batch": {"maxDelay": ms, "maxMessages": n}}`. Requested
+        values are capped by the server batch configuration.
+        """
+        if not options or isinstance(self.ws, ws.BatchWriter):
+            return
+
+        batch_conf = self.config.get("batch_conf", None) or {}
+        max_delay = batch_conf.get("max_delay", 0.1)
+        max_messages = batch_conf.get("max_messages", 100)
+
+        if isinstance(options, dict):
+            try:
+                max_delay = min(max_delay, float(options.get("maxDelay", 0)) / 1000)
+                max_messages = min(max_messages, int(options.get("maxMessages", max_messages)))
+            except (TypeError, ValueError):
+                log.warning("Invalid batch options from %s: %s", self.ws.remote_ip, options)
+                return
+        else:
+            max_delay = 0
+
+        log.debug("Batching enabled for %s: %s ms, %s messages", self.ws.remote_ip,
+                  max_delay * 1000, max_messages)
+        self.ws = ws.BatchWriter(self.ws, max_delay=max(0, max_delay),
+                                 max_messages=max(1, max_messages))
+
+    @asyncio.coroutine
+    def is_subscription_allowed(self, routing_key:str) -> bool:
+        """
+        Check that authenticated user is member of the
+        project the routing key belongs to.
+        """
+        try:
+            project_id = permissions.get_project_id(routing_key)
+        except ValueError:
+            return False
+
+        if project_id is None:
+            return True
+        return (yield from self.memberships.is_member(self.identity.user_id, project_id))
 
     @asyncio.coroutine
     def add_subscription(self, routing_key):
         log.debug("Initializing subsciption to: {}".format(routing_key))
 
-        subscription = Subscription(self.identity, routing_key, self.queues, self.ws)
+        if routing_key in self.subscriptions:
+            log.debug("Already subscribed to %s by %s", routing_key, self.ws.remote_ip)
+            return
+
+        if topics.is_pattern(routing_key) and not self.queues.supports_patterns:
+            self.ws.write(serialize_data({"error": "Pattern subscriptions not supported",
+                                          "routing_key": routing_key}))
+            return
+
+        if not (yield from self.is_subscription_allowed(routing_key)):
+            log.info("Subscription to %s not allowed for %s", routing_key, self.ws.remote_ip)
+            self.ws.write(serialize_data({"error": "Subscription not allowed",
+                                          "routing_key": routing_key}))
+            return
+
+        # Connection closed or same key subscribed while
+        # checking memberships.
+        if self.closed or routing_key in self.subscriptions:
+            return
+
+        subscription = Subscription(self.identity, routing_key, self.queues, self.ws,
+                                    binary=self.binary)
         yield from subscription.start()
         self.subscriptions[routing_key] = subscription
 
@@ -179,6 +330,9 @@ class ConnectionHandler(object):
 
         if cmd == "subscribe":
             routing_key = message.get("routing_key", None)
+            if not routing_key:
+                log.warning("Subscription without routing key from %s", self.ws.remote_ip)
+                return
             yield from self.add_subscription(routing_key)
         elif cmd == "unsubscribe":
             routing_key = message.get("routing_key", None)
@@ -188,17 +342,23 @@ class ConnectionHandler(object):
 
 
 class EventsHandler(ws.WebSocketHandler):
-    def on_initialize(self, config:dict):
+    def on_initialize(self, config:dict, *, hub, auth, memberships, connections):
         self.config = config
+        self.hub = hub
+        self.auth = auth
+        self.memberships = memberships
+        self.connections = connections
 
     def on_open(self, ws):
         log.debug("Websocket connection opened from %s", ws.remote_ip)
-        self.t = ConnectionHandler(ws, self.config)
+        self.t = ConnectionHandler(ws, self.config, self.hub, self.auth,
+                                   self.memberships, self.connections)
 
     def on_message(self, ws, message):
         log.debug("Websocket message received from %s: %s", ws.remote_ip, message)
-        asyncio.Task(self.t.add_message(json.loads(message)))
+        self.t.receive(json.loads(message))
 
     def on_close(self, ws):
         log.debug("Websocket connection closed from %s", ws.remote_ip)
-        asyncio.Task(self.t.close())
+        profiling.label(asyncio.Task(self.t.close()),
+                        "handler on_close from {0}", ws.remote_ip)
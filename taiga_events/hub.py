@@ -0,0 +1,243 @@
+import asyncio
+import logging
+
+from collections import namedtuple, OrderedDict
+
+from taiga_events import metrics
+from taiga_events import profiling
+from taiga_events.queues import base
+from taiga_events.utils.ringbuffer import RingBuffer
+from taiga_events.utils.topics import TopicTrie
+
+log = logging.getLogger("taiga.hub")
+
+HubSubscription = namedtuple("HubSubscription", ["routing_key", "queue"])
+
+
+class _Upstream(object):
+    """
+    Single upstream subscription shared by all local
+    subscribers of one routing key.
+    """
+
+    def __init__(self, routing_key, coalesce_window:float=0):
+        self.routing_key = routing_key
+        self.subscription = None
+        self.pump = None
+        self.queues = set()
+
+        # Task opening the upstream subscription
+        self.ready = None
+
+        self.coalesce_window = coalesce_window
+        self.pending = OrderedDict()
+        self.flush_handle = None
+
+
+class SubscriptionsHub(base.EventsQueue):
+    """
+    Process wide fan-out layer between connection handlers
+    and a queue implementation.
+
+    It holds exactly one upstream subscription per routing key,
+    reference counts local subscribers and delivers each received
+    message to all of them.
+
+    Routing keys matching `coalesce_keys` patterns are delivered
+    every `coalesce_window` seconds instead, keeping only the latest
+    message of each object received in the window.
+    """
+
+    def __init__(self, queues:base.EventsQueue, *, coalesce_window:float=0,
+                 coalesce_keys=("#",)):
+        self.queues = queues
+        self.coalesce_window = coalesce_window
+        self._upstreams = {}
+
+        self._coalesce_keys = TopicTrie()
+        for pattern in coalesce_keys:
+            self._coalesce_keys.add(pattern, pattern)
+
+    @property
+    def supports_patterns(self) -> bool:
+        return self.queues.supports_patterns
+
+    @property
+    def upstream_count(self) -> int:
+        return len(self._upstreams)
+
+    @property
+    def subscribers_total(self) -> int:
+        return sum(len(upstream.queues) for upstream in self._upstreams.values())
+
+    def coalesce_window_for(self, routing_key:str) -> float:
+        if self.coalesce_window and self._coalesce_keys.match(routing_key):
+            return self.coalesce_window
+        return 0
+
+    def subscribers_count(self, routing_key:str) -> int:
+        upstream = self._upstreams.get(routing_key, None)
+        if upstream is None:
+            return 0
+        return len(upstream.queues)
+
+    @asyncio.coroutine
+    def warm(self):
+        yield from self.queues.warm()
+
+    @asyncio.coroutine
+    def subscribe(self, routing_key:str, buffer_size:int=10):
+        queue = RingBuffer(buffer_size)
+        upstream = self._upstreams.get(routing_key, None)
+
+        if upstream is None:
+            upstream = _Upstream(routing_key, self.coalesce_window_for(routing_key))
+            self._upstreams[routing_key] = upstream
+
+            # Opened apart from the first subscriber, so cancelling
+            # it never cancels the other ones waiting for it.
+            upstream.ready = profiling.label(asyncio.Task(self._open_upstream(upstream)),
+                                             "hub open {0}", routing_key)
+
+        upstream.queues.add(queue)
+        try:
+            yield from asyncio.shield(upstream.ready)
+        except BaseException:
+            upstream.queues.discard(queue)
+
+            # Cancelled right after the upstream was opened, it is
+            # forgotten now so no new subscriber can join it.
+            if upstream.ready.done() and not upstream.queues:
+                if self._upstreams.get(routing_key, None) is upstream:
+                    del self._upstreams[routing_key]
+                asyncio.Task(self._close_upstream(upstream))
+            raise
+
+        return HubSubscription(routing_key, queue)
+
+    @asyncio.coroutine
+    def _open_upstream(self, upstream):
+        try:
+            upstream.subscription = yield from self.queues.subscribe(upstream.routing_key)
+        except Exception:
+            if self._upstreams.get(upstream.routing_key, None) is upstream:
+                del self._upstreams[upstream.routing_key]
+            raise
+
+        log.debug("Upstream subscription opened for %s", upstream.routing_key)
+        upstream.pump = profiling.label(asyncio.Task(self._pump(upstream)),
+                                        "hub {0} ({1})", upstream.routing_key,
+                                        type(self.queues).__name__)
+
+        # All subscribers may have left while opening
+        if not upstream.queues:
+            yield from self._close_upstream(upstream)
+
+    @asyncio.coroutine
+    def _close_upstream(self, upstream):
+        if self._upstreams.get(upstream.routing_key, None) is upstream:
+            del self._upstreams[upstream.routing_key]
+        log.debug("Upstream subscription closed for %s", upstream.routing_key)
+
+        if upstream.flush_handle:
+            upstream.flush_handle.cancel()
+        if upstream.pump:
+            upstream.pump.cancel()
+        if upstream.subscription is not None:
+            yield from self.queues.close_subscription(upstream.subscription)
+
+    @asyncio.coroutine
+    def close_subscription(self, subscription):
+        assert isinstance(subscription, HubSubscription)
+
+        routing_key, queue = subscription
+        upstream = self._upstreams.get(routing_key, None)
+        if upstream is None or queue not in upstream.queues:
+            return
+
+        upstream.queues.discard(queue)
+        if upstream.queues:
+            return
+
+        yield from self._close_upstream(upstream)
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Close all upstream subscriptions and then
+        the queue implementation.
+        """
+        upstreams, self._upstreams = self._upstreams, {}
+        for upstream in upstreams.values():
+            if not upstream.ready.done():
+                upstream.ready.cancel()
+            if upstream.flush_handle:
+                upstream.flush_handle.cancel()
+            if upstream.pump:
+                upstream.pump.cancel()
+            if upstream.subscription is not None:
+                yield from self.queues.close_subscription(upstream.subscription)
+
+        yield from self.queues.close()
+
+    @asyncio.coroutine
+    def consume_message(self, subscription):
+        assert isinstance(subscription, HubSubscription)
+        return (yield from subscription.queue.get())
+
+    @asyncio.coroutine
+    def _pump(self, upstream):
+        try:
+            while True:
+                msg = yield from self.queues.consume_message(upstream.subscription)
+                metrics.messages_received.inc()
+
+                if upstream.coalesce_window:
+                    self._coalesce(upstream, msg)
+                else:
+                    self._deliver(upstream, msg)
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            log.error("Unhandled exception", exc_info=True, stack_info=False)
+
+            # Subscribers report the error to their clients
+            for queue in tuple(upstream.queues):
+                queue.fail(e)
+
+            # Forget the broken upstream so the next subscriber
+            # to this routing key opens a fresh one.
+            if self._upstreams.get(upstream.routing_key, None) is upstream:
+                del self._upstreams[upstream.routing_key]
+                yield from self.queues.close_subscription(upstream.subscription)
+
+    def _deliver(self, upstream, msg):
+        # A slow subscriber should never block the
+        # delivery to the rest of subscribers.
+        for queue in tuple(upstream.queues):
+            base.put_message(queue, msg, origin="hub",
+                             routing_key=upstream.routing_key)
+
+    def _coalesce(self, upstream, msg):
+        # Messages without object are never collapsed
+        key = msg
+        if msg.object_id is not None:
+            key = (msg.routing_key, msg.object_id)
+
+        if upstream.pending.pop(key, None) is not None:
+            metrics.messages_coalesced.inc()
+            metrics.deliveries_coalesced.inc(len(upstream.queues))
+        upstream.pending[key] = msg
+
+        if upstream.flush_handle is None:
+            loop = asyncio.get_event_loop()
+            upstream.flush_handle = loop.call_later(upstream.coalesce_window,
+                                                    self._flush, upstream)
+
+    def _flush(self, upstream):
+        upstream.flush_handle = None
+        pending, upstream.pending = upstream.pending, OrderedDict()
+        for msg in pending.values():
+            self._deliver(upstream, msg)
@@ -1,6 +1,8 @@
 import asyncio
 import argparse
 import copy
+import math
+import signal
 import sys
 import logging
 
@@ -8,37 +10,324 @@ import logging
 from tornado.platform.asyncio import AsyncIOMainLoop
 AsyncIOMainLoop().install()
 
-from tornado.web import Application
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.web import Application, RequestHandler
 from .handlers import EventsHandler
 from .adapter import adapt_handler
+from .hub import SubscriptionsHub
+from . import auth
+from . import metrics
+from . import permissions
+from . import profiling
+from . import repository
+from . import classloader as loader
+from . import websocket
+from . import workers
+from .queues import base
 
 
+log = logging.getLogger("taiga")
+
 DEFAULT_CONFIG = {
     "debug": True,
     "queue_conf": None,
     "repo_conf": None,
+    "outbound_conf": None,
+    "auth_conf": None,
+    "permissions_conf": None,
+    "shutdown_conf": None,
+    "profiling_conf": None,
+    "coalesce_conf": None,
+    "batch_conf": None,
+    "compression_conf": None,
+    "metrics_conf": None,
 }
 
+# Close code sent to clients on shutdown, so they
+# reconnect to other node (1012: service restart).
+SHUTDOWN_CLOSE_CODE = 1012
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Expose process metrics in Prometheus text format. Served
+    apart from the events endpoint, only if it is enabled.
+    """
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.registry.render())
+
+
+def register_metrics(hub:SubscriptionsHub, connections:set, *,
+                     verifier:auth.BatchVerifier=None, repo:repository.Repository=None):
+    """
+    Register the metrics computed on scrape
+    from the application state.
+    """
+    backend = type(hub.queues).__module__ + "." + type(hub.queues).__name__
+    registry = metrics.registry
+
+    registry.collector("taiga_events_open_connections",
+                       "Open websocket connections.",
+                       lambda: [({}, len(connections))])
+    registry.collector("taiga_events_active_subscriptions",
+                       "Subscriptions opened by websocket connections.",
+                       lambda: [({"backend": backend}, hub.subscribers_total)])
+    registry.collector("taiga_events_upstream_subscriptions",
+                       "Subscriptions opened to the queue backend.",
+                       lambda: [({"backend": backend}, hub.upstream_count)])
+    registry.collector("taiga_events_upstream_connections",
+                       "Connections opened to the queue backend.",
+                       lambda: [({"backend": backend}, hub.queues.connection_count)])
+    registry.collector("taiga_events_outbound_buffer_bytes",
+                       "Bytes queued on websocket connections waiting to be sent.",
+                       lambda: [({}, sum(c.ws.outbound_bytes for c in connections))])
+
+    def dropped_messages():
+        samples = [({"origin": origin}, count)
+                   for origin, count in sorted(base.overflow_stats.items())]
+        samples.append(({"origin": "outbound"}, websocket.overflow_stats["dropped_messages"]))
+        return samples
+
+    registry.collector("taiga_events_messages_dropped_total",
+                       "Messages dropped because a buffer was full.",
+                       dropped_messages, type="counter")
+    registry.collector("taiga_events_outbound_overflows_total",
+                       "Times an outbound overflow policy has been applied.",
+                       lambda: [({"policy": policy}, websocket.overflow_stats[policy])
+                                for policy in websocket.POLICIES],
+                       type="counter")
+
+    if verifier is not None:
+        registry.collector("taiga_events_auth_cache_hits_total",
+                           "Tokens found in the verified tokens cache.",
+                           lambda: [({}, verifier.stats()["hits"])], type="counter")
+        registry.collector("taiga_events_auth_cache_misses_total",
+                           "Tokens not found in the verified tokens cache.",
+                           lambda: [({}, verifier.stats()["misses"])], type="counter")
+        registry.collector("taiga_events_auth_pending_tokens",
+                           "Tokens waiting for a verification batch.",
+                           lambda: [({}, verifier.stats()["pending"])])
+
+    if repo is not None:
+        def pool_connections():
+            stats = repo.pool.stats()
+            return [({"state": state}, stats[state]) for state in ("free", "in_use")]
+
+        registry.collector("taiga_events_repository_connections",
+                           "Connections of the repository pool.",
+                           pool_connections)
+        registry.collector("taiga_events_repository_waiters",
+                           "Coroutines waiting for a repository connection.",
+                           lambda: [({}, repo.pool.stats()["waiting"])])
+        registry.collector("taiga_events_repository_connections_created_total",
+                           "Connections opened by the repository pool.",
+                           lambda: [({}, repo.pool.stats()["created"])], type="counter")
+
 
 def make_app(config:dict) -> Application:
+    # One hub per process, shared by all websocket connections
+    coalesce_conf = config.get("coalesce_conf", None) or {}
+    hub = SubscriptionsHub(loader.load_queue_implementation(config),
+                           coalesce_window=coalesce_conf.get("window", 0),
+                           coalesce_keys=coalesce_conf.get("routing_keys", ("#",)))
+    verifier = auth.make_verifier(config)
+    repo = repository.make_repository(config)
+    memberships = permissions.make_index(config, repo)
+    connections = set()
+    tasks = []
+
+    # Keep memberships index up to date with membership changes
+    permissions_conf = config.get("permissions_conf", None) or {}
+    membership_key = permissions_conf.get("membership_key", None)
+    if membership_key:
+        tasks.append(asyncio.Task(memberships.watch(hub, membership_key)))
+
+    # Opt-in slow callbacks profiler
+    profiler = None
+    profiling_conf = config.get("profiling_conf", None)
+    if profiling_conf is not None:
+        profiler = profiling.LoopProfiler(**profiling_conf)
+        profiler.install()
+
+    register_metrics(hub, connections, verifier=verifier, repo=repo)
+    lag_monitor = metrics.LoopLagMonitor(metrics.loop_lag)
+    lag_monitor.start()
+
     handlers = [
-       (r"/events", adapt_handler(EventsHandler), {"config": config}),
+       (r"/events", adapt_handler(EventsHandler), {"config": config, "hub": hub,
+                                                   "auth": verifier,
+                                                   "memberships": memberships,
+                                                   "connections": connections}),
     ]
-    return Application(handlers, debug=config["debug"])
+    return Application(handlers, debug=config["debug"], config=config, hub=hub,
+                       auth=verifier, repository=repo, memberships=memberships,
+                       connections=connections,
+                       tasks=tasks, lag_monitor=lag_monitor, profiler=profiler)
+
+
+def bind_metrics_sockets(config:dict, worker_id:int=0) -> list:
+    """
+    Bind the sockets of the metrics endpoint, or return
+    None if it is not enabled.
+
+    Metrics are kept per process, so every worker serves
+    them on its own port: the configured one plus its id.
+    """
+    metrics_conf = config.get("metrics_conf", None)
+    if metrics_conf is None:
+        return None
+
+    port = metrics_conf.get("port", 9100) + worker_id
+    address = metrics_conf.get("address", "127.0.0.1")
+    print("Metrics available on: http://{0}:{1}/metrics".format(address, port),
+          file=sys.stderr)
+    return bind_sockets(port, address)
+
+
+def start_metrics(sockets:list) -> HTTPServer:
+    server = HTTPServer(Application([(r"/metrics", MetricsHandler)]))
+    server.add_sockets(sockets)
+    return server
+
+
+@asyncio.coroutine
+def warm_app(application:Application):
+    """
+    Open and check upstream and database connections,
+    so the first clients don't pay for them.
+    """
+    settings = application.settings
+    yield from settings["hub"].warm()
+    yield from settings["repository"].pool.fill()
 
 
-def start_app(application:Application, *, port:int=8888, join:bool=True):
-    application.listen(port)
-    print("Now listening on: http://127.0.0.1:{0}".format(port), file=sys.stderr)
+def run_warm_app(application:Application) -> bool:
+    try:
+        asyncio.get_event_loop().run_until_complete(warm_app(application))
+    except Exception:
+        log.error("Unable to connect to upstream services", exc_info=True)
+        return False
+    return True
+
+
+@asyncio.coroutine
+def drain_app(application:Application, server:HTTPServer, *, window:float=10,
+              tick:float=0.05):
+    """
+    Gracefully shutdown the application: stop accepting connections,
+    ask clients to reconnect elsewhere spreading the closes over
+    `window` seconds, wait for all subscriptions to be closed and
+    then release upstream connections.
+    """
+    settings = application.settings
+    server.stop()
+
+    connections = list(settings["connections"])
+    log.info("Draining %s connections in %s seconds", len(connections), window)
+
+    if window > 0:
+        per_tick = max(1, math.ceil(len(connections) * tick / window))
+    else:
+        per_tick = max(1, len(connections))
+
+    for index in range(0, len(connections), per_tick):
+        chunk = connections[index:index + per_tick]
+        for handler in chunk:
+            try:
+                handler.ws.close(SHUTDOWN_CLOSE_CODE, "Reconnect elsewhere")
+            except Exception:
+                log.debug("Connection already closed", exc_info=True)
+
+        yield from asyncio.wait([handler.close() for handler in chunk])
+        if index + per_tick < len(connections):
+            yield from asyncio.sleep(tick)
+
+    for task in settings["tasks"]:
+        task.cancel()
+    settings["lag_monitor"].stop()
+    if settings["profiler"] is not None:
+        settings["profiler"].report()
+        settings["profiler"].uninstall()
+
+    yield from settings["hub"].close()
+    settings["repository"].pool.close()
+    settings["auth"].close()
+
+
+def start_app(application:Application, *, port:int=8888, sockets:list=None,
+              metrics_sockets:list=None, join:bool=True):
+    server = HTTPServer(application)
+    if sockets is None:
+        server.listen(port)
+        print("Now listening on: http://127.0.0.1:{0}".format(port), file=sys.stderr)
+    else:
+        server.add_sockets(sockets)
+
+    if metrics_sockets is None:
+        metrics_sockets = bind_metrics_sockets(application.settings["config"])
+    if metrics_sockets is not None:
+        start_metrics(metrics_sockets)
 
     if join:
+        loop = asyncio.get_event_loop()
+        shutdown_conf = application.settings["config"].get("shutdown_conf", None) or {}
+
+        def on_sigterm():
+            loop.remove_signal_handler(signal.SIGTERM)
+            task = asyncio.Task(drain_app(application, server, **shutdown_conf))
+            task.add_done_callback(on_drained)
+
+        def on_drained(task):
+            exc = None if task.cancelled() else task.exception()
+            if exc is not None:
+                log.error("Unable to drain connections",
+                          exc_info=(type(exc), exc, exc.__traceback__))
+            loop.stop()
+
         try:
-            loop = asyncio.get_event_loop()
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
             loop.run_forever()
         except KeyboardInterrupt:
             loop.stop()
 
 
+def start_worker(config:dict, sockets:list, worker_id:int):
+    """
+    Run the application on a forked worker process with its own
+    event loop, hub and upstream connections.
+    """
+    # The loop inherited from the parent process shares
+    # its selector with it, so it can't be used here.
+    asyncio.get_event_loop().close()
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    IOLoop.clear_instance()
+    AsyncIOMainLoop().install()
+
+    app = make_app(config)
+    if not run_warm_app(app):
+        return 1
+    return start_app(app, sockets=sockets,
+                     metrics_sockets=bind_metrics_sockets(config, worker_id))
+
+
+def start_workers(config:dict, *, port:int=8888, count:int=1) -> int:
+    """
+    Fork `count` worker processes sharing the listening port.
+    """
+    sockets = bind_sockets(port)
+    print("Now listening on: http://127.0.0.1:{0} with {1} workers".format(port, count),
+          file=sys.stderr)
+
+    target = lambda sockets, worker_id: start_worker(config, sockets, worker_id)
+    supervisor = workers.Supervisor(count, target, sockets)
+    return supervisor.run()
+
+
 def parse_config_file(path:str) -> dict:
     """
     Given a path to a config file return a parsed
@@ -70,6 +359,9 @@ def apply_args_to_config(config:dict, args) -> dict:
     if args.tornado_debug is not None:
         config["debug"] = args.tornado_debug
 
+    if args.profile and config.get("profiling_conf", None) is None:
+        config["profiling_conf"] = {}
+
     return config
 
 
@@ -83,6 +375,10 @@ def main():
                         default=None, help="Run with debug mode activeted on tornado app.")
     parser.add_argument("-f", "--config", dest="configfile", action="store",
                         help="Read configuration from python config file", required=True)
+    parser.add_argument("-w", "--workers", dest="workers", action="store", type=int,
+                        default=1, help="Number of worker processes sharing the port.")
+    parser.add_argument("-P", "--profile", dest="profile", action="store_true",
+                        default=False, help="Log slow event loop callbacks and lag.")
 
     args = parser.parse_args()
     config = parse_config_file(args.configfile)
@@ -107,5 +403,11 @@ def main():
         print("Wrong log level: {0}".format(args.loglevel), file=sys.stderr)
         return -1
 
-    app = make_app(apply_args_to_config(config, args))
+    config = apply_args_to_config(config, args)
+    if args.workers > 1:
+        return start_workers(config, port=args.port, count=args.workers)
+
+    app = make_app(config)
+    if not run_warm_app(app):
+        return -1
     return start_app(app, port=args.port)
@@ -0,0 +1,111 @@
+import base64
+import json
+import time
+
+from .utils import packing
+from .websocket import Frame, BinaryFrame
+
+
+def _object_id(data:dict):
+    """
+    Identify the object a change event refers to,
+    or None if it can't be determined.
+    """
+    if not isinstance(data, dict) or data.get("pk", None) is None:
+        return None
+    return (data.get("matches", None), data["pk"])
+
+
+def _json_default(value):
+    # Packed upstream payloads may hold binary values,
+    # JSON clients receive them base64 encoded.
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+class Message(object):
+    """
+    Event received from upstream, shared read-only by
+    all of its recipients.
+
+    The payload is decoded once on creation and the wire
+    representation is built lazily and cached, so a message
+    delivered to many subscribers is serialized only once.
+    """
+
+    __slots__ = ("payload", "data", "session_id", "object_id", "routing_key",
+                 "received_at", "_encoded", "_frames", "_packed", "_binary_frames")
+
+    def __init__(self, payload, routing_key:str=None):
+        self.payload = payload
+
+        # Routing key the event was published with, if
+        # known. Pattern subscribers are sent this one.
+        self.routing_key = routing_key
+
+        # Upstream payloads are JSON texts or packed maps
+        if packing.is_map(payload):
+            self.data = packing.unpackb(payload)
+            self._packed = payload
+        else:
+            self.data = json.loads(payload)
+            self._packed = None
+
+        self.session_id = self.data.get("session_id", None)
+        self.object_id = _object_id(self.data)
+        self.received_at = time.monotonic()
+        self._encoded = {}
+        self._frames = {}
+        self._binary_frames = {}
+
+    def __repr__(self):
+        return "<Message: {0}>".format(self.payload)
+
+    def encode(self, routing_key:str) -> str:
+        """
+        Return the json text sent to clients subscribed
+        with the given routing key.
+        """
+        encoded = self._encoded.get(routing_key, None)
+        if encoded is None:
+            data = dict(self.data)
+            data["routing_key"] = routing_key
+            encoded = self._encoded[routing_key] = json.dumps(data, default=_json_default)
+        return encoded
+
+    def pack(self, routing_key:str) -> bytes:
+        """
+        Return the MessagePack data sent to clients subscribed with
+        the given routing key. Packed upstream payloads are reused
+        as they are, only the routing key is appended to them.
+        """
+        # Upstream routing key is replaced, never duplicated
+        if "routing_key" in self.data:
+            data = dict(self.data)
+            data["routing_key"] = routing_key
+            return packing.packb(data)
+
+        if self._packed is None:
+            self._packed = packing.packb(self.data)
+        return packing.add_str_item(self._packed, "routing_key", routing_key)
+
+    def binary_frame(self, routing_key:str) -> BinaryFrame:
+        """
+        Return the binary websocket frame shared by all
+        clients subscribed with the given routing key.
+        """
+        frame = self._binary_frames.get(routing_key, None)
+        if frame is None:
+            frame = self._binary_frames[routing_key] = BinaryFrame(self.pack(routing_key))
+        return frame
+
+    def frame(self, routing_key:str) -> Frame:
+        """
+        Return the websocket frame shared by all
+        clients subscribed with the given routing key.
+        """
+        frame = self._frames.get(routing_key, None)
+        if frame is None:
+            frame = self._frames[routing_key] = Frame(self.encode(routing_key))
+        return frame
@@ -0,0 +1,205 @@
+"""
+Process metrics exposed in Prometheus text format.
+
+Hot path metrics (counters and histograms) are allocated once at
+import time and updated with plain attribute arithmetic. Values
+that are cheap to compute on demand (open connections, buffered
+bytes...) are collected with callbacks when metrics are scraped.
+"""
+
+import asyncio
+import bisect
+
+# Latency buckets in seconds, from 100µs to 10s
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labels:dict) -> str:
+    if not labels:
+        return ""
+    items = ",".join('{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+                     for k, v in sorted(labels.items()))
+    return "{" + items + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    type = "counter"
+
+    __slots__ = ("name", "help", "labels", "value")
+
+    def __init__(self, name:str, help:str, labels:dict=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram(object):
+    type = "histogram"
+
+    __slots__ = ("name", "help", "labels", "buckets", "counts", "sum", "count")
+
+    def __init__(self, name:str, help:str, labels:dict=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            labels = dict(self.labels, le=_format_value(bound))
+            yield self.name + "_bucket", labels, cumulative
+
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+
+class Collector(object):
+    """
+    Metric whose samples are computed by `callback` when scraped.
+    The callback returns a list of (labels, value) pairs.
+    """
+
+    __slots__ = ("name", "help", "type", "callback")
+
+    def __init__(self, name:str, help:str, callback, type:str="gauge"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in self.callback():
+            yield self.name, labels, value
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name:str, help:str, labels:dict=None) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name:str, help:str, labels:dict=None,
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, name:str, help:str, callback, type:str="gauge") -> Collector:
+        """
+        Register a callback metric, replacing any
+        previous collector with the same name.
+        """
+        self._metrics = [m for m in self._metrics
+                         if not (isinstance(m, Collector) and m.name == name)]
+        return self.register(Collector(name, help, callback, type))
+
+    def render(self) -> str:
+        lines = []
+        described = set()
+
+        for metric in self._metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append("# HELP {0} {1}".format(metric.name, metric.help))
+                lines.append("# TYPE {0} {1}".format(metric.name, metric.type))
+
+            for name, labels, value in metric.samples():
+                lines.append("{0}{1} {2}".format(name, _format_labels(labels),
+                                                 _format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor(object):
+    """
+    Measures how late the event loop runs a callback
+    scheduled every `interval` seconds. If given, `on_sample`
+    is called with every measured lag.
+    """
+
+    def __init__(self, histogram:Histogram, *, interval:float=1, on_sample=None, loop=None):
+        self.histogram = histogram
+        self.interval = interval
+        self.on_sample = on_sample
+        self.lag = 0.0
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._handle = None
+        self._expected = None
+
+    def start(self):
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._tick)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        now = self._loop.time()
+        self.lag = max(0.0, now - self._expected)
+        self.histogram.observe(self.lag)
+        if self.on_sample is not None:
+            self.on_sample(self.lag)
+
+        self._expected = now + self.interval
+        self._handle = self._loop.call_at(self._expected, self._tick)
+
+
+registry = Registry()
+
+messages_received = registry.counter(
+    "taiga_events_messages_received_total",
+    "Messages received from upstream subscriptions.")
+
+messages_delivered = registry.counter(
+    "taiga_events_messages_delivered_total",
+    "Messages written to websocket connections.")
+
+messages_coalesced = registry.counter(
+    "taiga_events_messages_coalesced_total",
+    "Upstream messages replaced by a newer one for the same object.")
+
+deliveries_coalesced = registry.counter(
+    "taiga_events_deliveries_coalesced_total",
+    "Subscriber deliveries saved by coalescing.")
+
+delivery_latency = registry.histogram(
+    "taiga_events_delivery_latency_seconds",
+    "Time from upstream receipt to websocket write.")
+
+auth_latency = registry.histogram(
+    "taiga_events_auth_latency_seconds",
+    "Time spent authenticating connections.")
+
+loop_lag = registry.histogram(
+    "taiga_events_event_loop_lag_seconds",
+    "Event loop scheduling delay.")
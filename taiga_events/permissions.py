@@ -0,0 +1,131 @@
+import asyncio
+import logging
+
+from . import repository as repo
+from .utils import topics
+from .utils.cache import LRUCache
+
+log = logging.getLogger("taiga.permissions")
+
+
+def get_project_id(routing_key:str):
+    """
+    Given a routing key like "changes.project.42.userstories",
+    return its project id, or None if the routing key is not
+    bound to a project.
+
+    Raises ValueError for malformed project ids, and for
+    patterns that could match keys of more than one project.
+    """
+    parts = routing_key.split(".")
+    try:
+        index = parts.index("project")
+    except ValueError:
+        if topics.is_pattern(routing_key):
+            raise ValueError("Pattern not bound to a project: {0}".format(routing_key))
+        return None
+
+    if index + 1 >= len(parts):
+        raise ValueError("Routing key without project id: {0}".format(routing_key))
+
+    if topics.is_pattern(".".join(parts[:index + 2])):
+        raise ValueError("Pattern not bound to a project: {0}".format(routing_key))
+    return int(parts[index + 1])
+
+
+class MembershipIndex(object):
+    """
+    In memory index of the projects of each user, backed
+    by the repository.
+
+    Entries expire after `cache_ttl` seconds and are
+    invalidated by membership change events, so checks
+    are set lookups that don't touch the database.
+    """
+
+    def __init__(self, repository:repo.Repository, *, cache_size:int=10000,
+                 cache_ttl:float=300):
+        self.repository = repository
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self._loading = {}
+
+        # Bumped on every invalidation, loads started
+        # before it are returned but not cached.
+        self._generation = 0
+
+    @asyncio.coroutine
+    def get_projects(self, user_id:int) -> frozenset:
+        projects = self.cache.get(user_id, None)
+        if projects is not None:
+            return projects
+
+        # Concurrent lookups for the same user
+        # share one database query.
+        entry = self._loading.get(user_id, None)
+        if entry is None:
+            generation = self._generation
+            entry = (generation, asyncio.Task(self._load(user_id, generation)))
+            self._loading[user_id] = entry
+
+        return (yield from asyncio.shield(entry[1]))
+
+    @asyncio.coroutine
+    def is_member(self, user_id:int, project_id:int) -> bool:
+        projects = yield from self.get_projects(user_id)
+        return project_id in projects
+
+    def invalidate(self, user_id:int=None):
+        """
+        Forget memberships of a user, or all of
+        them if no user is given.
+        """
+        self._generation += 1
+
+        # Lookups in flight may have read the old memberships
+        if user_id is None:
+            self.cache.clear()
+            self._loading.clear()
+        else:
+            self.cache.invalidate(user_id)
+            self._loading.pop(user_id, None)
+
+    @asyncio.coroutine
+    def watch(self, queues, routing_key:str):
+        """
+        Invalidate cached memberships with the events received
+        from `routing_key`. Events carrying a "user_id" invalidate
+        that user, any other event invalidates the whole index.
+        """
+        sub = yield from queues.subscribe(routing_key)
+        try:
+            while True:
+                msg = yield from queues.consume_message(sub)
+                data = msg.data if isinstance(msg.data, dict) else {}
+                self.invalidate(data.get("user_id", None))
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception:
+            log.error("Unhandled exception", exc_info=True, stack_info=False)
+
+        yield from queues.close_subscription(sub)
+
+    @asyncio.coroutine
+    def _load(self, user_id:int, generation:int) -> frozenset:
+        try:
+            project_ids = yield from repo.get_user_project_id_list(self.repository, user_id)
+            projects = frozenset(project_ids)
+            if generation == self._generation:
+                self.cache.set(user_id, projects)
+            return projects
+        finally:
+            entry = self._loading.get(user_id, None)
+            if entry is not None and entry[0] == generation:
+                del self._loading[user_id]
+
+
+def make_index(config:dict, repository:repo.Repository) -> MembershipIndex:
+    permissions_conf = dict(config.get("permissions_conf", None) or {})
+    permissions_conf.pop("membership_key", None)
+    return MembershipIndex(repository, **permissions_conf)
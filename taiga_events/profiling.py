@@ -0,0 +1,204 @@
+"""
+Opt-in event loop profiler.
+
+When installed, every callback run by the event loop is timed and
+the ones exceeding a threshold are logged with their origin: the
+routing key of the subscription or hub task, the backend reader or
+the handler coroutine that was running. Slow callbacks and loop lag
+samples are also aggregated and periodically reported.
+"""
+
+import asyncio
+import functools
+import logging
+import platform
+import time
+import weakref
+
+from . import metrics
+
+log = logging.getLogger("taiga.profiling")
+
+# Human readable origin of tasks, only
+# filled while a profiler is installed.
+_origins = weakref.WeakKeyDictionary()
+_installed = None
+
+
+def label(task:asyncio.Task, origin:str, *args) -> asyncio.Task:
+    """
+    Attach an origin to the given task, used to identify
+    its slow steps. The origin is formatted with `args`
+    only if profiling is enabled.
+    """
+    if _installed is not None:
+        _origins[task] = origin.format(*args) if args else origin
+    return task
+
+
+def _coroutine_name(coro) -> str:
+    name = getattr(coro, "__qualname__", None)
+    if name is None:
+        code = getattr(coro, "gi_code", None)
+        name = code.co_name if code is not None else repr(coro)
+    return name
+
+
+def describe(callback, args=()) -> str:
+    """
+    Given a callback scheduled on the event loop,
+    return a short description of where it comes from.
+    """
+    while isinstance(callback, functools.partial):
+        args = callback.args
+        callback = callback.func
+
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        origin = _origins.get(owner, None)
+        if origin is None:
+            origin = "task " + _coroutine_name(getattr(owner, "_coro", None))
+        return origin
+
+    name = getattr(callback, "__qualname__", None) or repr(callback)
+
+    # Tornado runs its callbacks wrapped by the ioloop
+    if name.endswith("._run_callback") and args:
+        return describe(args[0])
+
+    module = getattr(callback, "__module__", None)
+    if module:
+        return "{0}.{1}".format(module, name)
+    return name
+
+
+class _Stats(object):
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed:float):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class LoopProfiler(object):
+    """
+    Time every event loop callback, logging the ones that take
+    longer than `threshold` seconds, and log an aggregated report
+    every `report_interval` seconds.
+    """
+
+    def __init__(self, *, threshold:float=0.05, report_interval:float=60,
+                 lag_interval:float=1, report_size:int=20, loop=None):
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.report_size = report_size
+
+        self.slow_callbacks = {}
+        self.lag = _Stats()
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._lag_monitor = metrics.LoopLagMonitor(
+            metrics.Histogram("profiler_loop_lag", "Event loop lag."),
+            interval=lag_interval, on_sample=self._on_lag_sample, loop=self._loop)
+        self._report_handle = None
+        self._original_run = None
+
+    def install(self):
+        global _installed
+        assert _installed is None, "a loop profiler is already installed"
+
+        # Callbacks are timed wrapping the pure python handles
+        # of asyncio loops, other loops run their own.
+        if not callable(getattr(asyncio.Handle, "_run", None)):
+            raise RuntimeError("Loop profiling is not supported on Python {0}".format(
+                               platform.python_version()))
+        if not isinstance(self._loop, asyncio.BaseEventLoop):
+            raise RuntimeError("Loop profiling is not supported on {0}".format(
+                               type(self._loop).__name__))
+
+        original_run = self._original_run = asyncio.Handle._run
+        profiler = self
+
+        def _run(handle):
+            started_at = time.monotonic()
+            try:
+                return original_run(handle)
+            finally:
+                elapsed = time.monotonic() - started_at
+                if elapsed >= profiler.threshold:
+                    profiler.record(handle, elapsed)
+
+        asyncio.Handle._run = _run
+        _installed = self
+
+        self._lag_monitor.start()
+        if self.report_interval:
+            self._report_handle = self._loop.call_later(self.report_interval,
+                                                        self._periodic_report)
+
+    def uninstall(self):
+        global _installed
+        if _installed is not self:
+            return
+
+        asyncio.Handle._run = self._original_run
+        _installed = None
+        _origins.clear()
+
+        self._lag_monitor.stop()
+        if self._report_handle is not None:
+            self._report_handle.cancel()
+            self._report_handle = None
+
+    def record(self, handle:asyncio.Handle, elapsed:float):
+        # Never let a profiling error break the event loop
+        try:
+            origin = describe(handle._callback, handle._args or ())
+        except Exception:
+            origin = repr(handle)
+
+        stats = self.slow_callbacks.get(origin, None)
+        if stats is None:
+            stats = self.slow_callbacks[origin] = _Stats()
+        stats.add(elapsed)
+
+        log.warning("Slow callback %s took %.3f seconds", origin, elapsed)
+
+    def report(self, *, reset:bool=True) -> list:
+        """
+        Log and return the slowest callback origins as
+        (origin, count, total, max) tuples, ordered
+        by total time.
+        """
+        rows = sorted(((origin, s.count, s.total, s.max)
+                       for origin, s in self.slow_callbacks.items()),
+                      key=lambda row: row[2], reverse=True)[:self.report_size]
+
+        lines = ["Event loop lag: {0} samples, mean {1:.3f}s, max {2:.3f}s".format(
+                 self.lag.count, self.lag.total / (self.lag.count or 1), self.lag.max)]
+        for origin, count, total, slowest in rows:
+            lines.append("  {0:>8.3f}s total {1:>6} calls {2:>8.3f}s max  {3}".format(
+                         total, count, slowest, origin))
+
+        log.warning("Loop profile report\n%s", "\n".join(lines))
+
+        if reset:
+            self.slow_callbacks = {}
+            self.lag = _Stats()
+        return rows
+
+    def _on_lag_sample(self, lag:float):
+        self.lag.add(lag)
+        if lag >= self.threshold:
+            log.warning("Event loop lagged %.3f seconds", lag)
+
+    def _periodic_report(self):
+        self.report()
+        self._report_handle = self._loop.call_later(self.report_interval,
+                                                    self._periodic_report)
@@ -1,10 +1,59 @@
 import abc
+import asyncio
+import logging
+
+from collections import Counter
+
+from taiga_events.utils.ringbuffer import RingBuffer
+
+log = logging.getLogger("taiga.queues")
+
+# Messages discarded because a subscription buffer was
+# full, by origin (backend or hub).
+overflow_stats = Counter()
+
+
+def put_message(buffer:RingBuffer, message, *, origin:str, routing_key:str) -> bool:
+    """
+    Put a message on a subscription buffer without ever
+    waiting for its consumer. When the buffer is full its
+    oldest message is overwritten and accounted in
+    `overflow_stats`.
+
+    Return False if a message has been discarded.
+    """
+    if buffer.push(message):
+        return True
+
+    overflow_stats[origin] += 1
+    log.debug("Subscription buffer full for %s (%s), oldest message discarded",
+              routing_key, origin)
+    return False
 
 class EventsQueue(object, metaclass=abc.ABCMeta):
     """
     Defines a module for access to queues.
     """
 
+    # Whether AMQP style "*" and "#" routing key
+    # patterns can be subscribed.
+    supports_patterns = True
+
+    @property
+    def connection_count(self) -> int:
+        """
+        Number of connections currently open to upstream.
+        """
+        return 0
+
+    @asyncio.coroutine
+    def warm(self):
+        """
+        Open upstream connections and check they work,
+        before any client is served.
+        """
+        pass
+
     @abc.abstractmethod
     def subscribe(self, routing_key:str, buffer_size:int=10):
         pass
@@ -17,3 +66,10 @@ class EventsQueue(object, metaclass=abc.ABCMeta):
     def consume_message(self, subscription):
         pass
 
+    @asyncio.coroutine
+    def close(self):
+        """
+        Release upstream connections shared by subscriptions,
+        called once when the process is shutting down.
+        """
+        pass
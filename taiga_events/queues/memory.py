@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+from collections import namedtuple
+
+from taiga_events.queues import base
+from taiga_events.messages import Message
+from taiga_events.utils.ringbuffer import RingBuffer
+from taiga_events.utils.topics import TopicTrie
+
+MemorySubscription = namedtuple("MemorySubscription", ["routing_key", "queue"])
+
+log = logging.getLogger("taiga.memory")
+
+
+class EventsQueue(base.EventsQueue):
+    """
+    In process queue implementation without any upstream
+    connection. Events are injected with `publish` and
+    routed like a topic exchange, so it can replace
+    real backends in tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.router = TopicTrie()
+
+    def publish(self, routing_key:str, payload:str) -> int:
+        """
+        Deliver the payload to all subscriptions matching
+        the routing key and return how many they are.
+        """
+        queues = self.router.match(routing_key)
+        if not queues:
+            return 0
+
+        message = Message(payload, routing_key)
+        for queue in queues:
+            base.put_message(queue, message, origin="memory", routing_key=routing_key)
+        return len(queues)
+
+    @asyncio.coroutine
+    def subscribe(self, routing_key:str, buffer_size:int=10):
+        queue = RingBuffer(buffer_size)
+        self.router.add(routing_key, queue)
+        return MemorySubscription(routing_key, queue)
+
+    @asyncio.coroutine
+    def close_subscription(self, subscription):
+        assert isinstance(subscription, MemorySubscription)
+        self.router.remove(subscription.routing_key, subscription.queue)
+
+    @asyncio.coroutine
+    def consume_message(self, subscription):
+        assert isinstance(subscription, MemorySubscription)
+        return (yield from subscription.queue.get())
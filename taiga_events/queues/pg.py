@@ -1,17 +1,73 @@
 import traceback
 import asyncio
 import logging
-import json
+import re
 
-from collections import namedtuple
+from collections import namedtuple, deque
 
+from taiga_events import profiling
 from taiga_events.queues import base
+from taiga_events.utils.ringbuffer import RingBuffer
+from taiga_events.messages import Message
 from taiga_events.utils import pg
 
-PgSubscription = namedtuple("PgSubscription", ["pgconn", "rcvloop", "queue"])
+PgSubscription = namedtuple("PgSubscription", ["pgconn", "rcvloop", "queue", "pending"])
+MultiplexedSubscription = namedtuple("MultiplexedSubscription",
+                                     ["listener", "channel", "queue", "pending"])
 
 log = logging.getLogger("taiga.pg")
 
+_CHANNEL_RX = re.compile(r"^[a-z0-9_]+$")
+
+
+def _channel_name(routing_key:str) -> str:
+    """
+    Given a routing key, return the postgresql
+    channel name where its events are notified.
+
+    Channel names are interpolated in LISTEN statements,
+    so routing keys with other characters are rejected.
+    """
+    channel = "events_{0}".format(routing_key.replace(".", "__")).lower()
+    if not _CHANNEL_RX.match(channel):
+        raise ValueError("Invalid routing key: {0!r}".format(routing_key))
+    return channel
+
+
+def _drain_notifies(cnn) -> list:
+    """
+    Take all pending notifications of the connection
+    in the same order as they have arrived.
+    """
+    notifies = cnn.notifies[:]
+    del cnn.notifies[:]
+    return notifies
+
+
+def _decode_notify(notify, routing_key:str=None) -> Message:
+    """
+    Build the message of a notification, or return None
+    if its payload is malformed.
+    """
+    try:
+        return Message(notify.payload, routing_key)
+    except Exception:
+        log.error("Invalid payload notified on %s: %r", notify.channel,
+                  notify.payload, exc_info=True, stack_info=False)
+        return None
+
+
+@asyncio.coroutine
+def _consume_pending(queue:RingBuffer, pending:deque):
+    """
+    Queues receive batches of messages, this returns them
+    one by one, waiting for the next batch when the
+    current one is exhausted.
+    """
+    if not pending:
+        pending.extend((yield from queue.get()))
+    return pending.popleft()
+
 
 @asyncio.coroutine
 def _subscribe(routing_key, *, dsn:str, buffer_size:int):
@@ -20,37 +76,47 @@ def _subscribe(routing_key, *, dsn:str, buffer_size:int):
     starts the consumer loop and return subscription instance.
     """
 
-    queue = asyncio.Queue(buffer_size)
+    # Invalid routing keys are rejected before connecting
+    channel = _channel_name(routing_key)
+    queue = RingBuffer(buffer_size)
     cnn = yield from pg.connect(dsn=dsn)
-    routing_key = routing_key.replace(".", "__")
 
     @asyncio.coroutine
     def _receive_messages_loop():
-        with cnn.cursor() as c:
+        try:
+            # LISTEN lasts for the whole connection lifecycle,
+            # so it is only issued once.
+            with cnn.cursor() as c:
+                yield from c.execute("LISTEN {0};".format(channel))
+
             while True:
-                try:
-                    yield from c.execute("LISTEN events_{0};".format(routing_key))
-                    yield from pg.wait_until_ready_read(cnn)
-                    cnn.poll()
+                yield from pg.wait_until_ready_read(cnn)
+                cnn.poll()
 
-                    while cnn.notifies:
-                        notify = cnn.notifies.pop()
-                        message = json.loads(notify.payload)
+                # A malformed payload never drops the rest of the burst
+                batch = [_decode_notify(n, routing_key) for n in _drain_notifies(cnn)]
+                batch = [message for message in batch if message is not None]
+                if batch:
+                    base.put_message(queue, batch, origin="pg", routing_key=routing_key)
 
-                        yield from queue.put(message)
+        except asyncio.CancelledError:
+            # This happens when browser closes the conection
+            # and we should stop a loop when it happens
+            pass
 
-                except asyncio.CancelledError:
-                    # This happens when browser closes the conection
-                    # and we should stop a loop when it happens
-                    break
+        except Exception as e:
+            log.error("Unhandled exception", exc_info=True, stack_info=False)
 
-                except Exception as e:
-                    log.error("Unhandled exception", exc_info=True, stack_info=False)
-                    break
+            # Let the consumer know, so it closes the subscription
+            queue.fail(e)
 
-    # TODO: add apropiate callback for proper connection close
-    rcvloop = asyncio.Task(_receive_messages_loop())
-    return PgSubscription(cnn, rcvloop, queue)
+    try:
+        rcvloop = profiling.label(asyncio.Task(_receive_messages_loop()),
+                                  "pg listen {0}", channel)
+    except Exception:
+        cnn.close()
+        raise
+    return PgSubscription(cnn, rcvloop, queue, deque())
 
 
 @asyncio.coroutine
@@ -61,7 +127,7 @@ def _close_subscription(subscription):
     """
     assert isinstance(subscription, PgSubscription)
 
-    cnn, rcvloop, queue = subscription
+    cnn, rcvloop, queue, pending = subscription
     rcvloop.cancel()
 
     pg.wait(cnn)
@@ -77,8 +143,8 @@ def _consume_message(subscription):
     """
     assert isinstance(subscription, PgSubscription)
 
-    cnn, rcvloop, queue = subscription
-    return (yield from queue.get())
+    cnn, rcvloop, queue, pending = subscription
+    return (yield from _consume_pending(queue, pending))
 
 
 class EventsQueue(base.EventsQueue):
@@ -86,15 +152,38 @@ class EventsQueue(base.EventsQueue):
     Public abstraction.
     """
 
+    # LISTEN only accepts literal channel names
+    supports_patterns = False
+
     def __init__(self, dsn):
         self.dsn = dsn
+        self._subscriptions = 0
+
+    @property
+    def connection_count(self) -> int:
+        # One connection per subscription
+        return self._subscriptions
+
+    @asyncio.coroutine
+    def warm(self):
+        # Connections are opened per subscription,
+        # so only check the server is reachable.
+        cnn = yield from pg.connect(dsn=self.dsn)
+        try:
+            with cnn.cursor() as c:
+                yield from c.execute("SELECT 1;")
+        finally:
+            cnn.close()
 
     @asyncio.coroutine
     def subscribe(self, routing_key:str, buffer_size:int=10):
-        return (yield from _subscribe(routing_key, dsn=self.dsn, buffer_size=buffer_size))
+        subscription = yield from _subscribe(routing_key, dsn=self.dsn, buffer_size=buffer_size)
+        self._subscriptions += 1
+        return subscription
 
     @asyncio.coroutine
     def close_subscription(self, subscription):
+        self._subscriptions -= 1
         return (yield from _close_subscription(subscription))
 
     @asyncio.coroutine
@@ -102,3 +191,231 @@ class EventsQueue(base.EventsQueue):
         return (yield from _consume_message(subscription))
 
 
+class Listener(object):
+    """
+    Owns one asynchronous postgresql connection and
+    multiplexes any number of LISTEN channels over it.
+
+    Notifications are dispatched to the queues registered
+    for its channel.
+    """
+
+    reconnect_delay = 1
+
+    def __init__(self, dsn:str, *, loop=None):
+        self.dsn = dsn
+        self.loop = loop or asyncio.get_event_loop()
+        self.cnn = None
+        self.channels = {}
+
+        self._lock = asyncio.Lock()
+        self._reconnecting = None
+
+    @asyncio.coroutine
+    def listen(self, channel:str, queue:RingBuffer):
+        with (yield from self._lock):
+            yield from self._ensure_connection()
+
+            if channel in self.channels:
+                self.channels[channel].add(queue)
+                return
+
+            self.channels[channel] = {queue}
+            try:
+                yield from self._execute("LISTEN {0};".format(channel))
+            except Exception:
+                del self.channels[channel]
+
+                # The server may have accepted the LISTEN
+                yield from self._unlisten_quietly(channel)
+                raise
+
+    @asyncio.coroutine
+    def connect(self):
+        """
+        Open the connection if it isn't yet
+        and check that it works.
+        """
+        with (yield from self._lock):
+            yield from self._ensure_connection()
+            yield from self._execute("SELECT 1;")
+
+    @asyncio.coroutine
+    def unlisten(self, channel:str, queue:RingBuffer):
+        with (yield from self._lock):
+            queues = self.channels.get(channel, None)
+            if queues is None:
+                return
+
+            queues.discard(queue)
+            if queues:
+                return
+
+            del self.channels[channel]
+            yield from self._unlisten_quietly(channel)
+
+    @asyncio.coroutine
+    def _unlisten_quietly(self, channel:str):
+        if self.cnn is None:
+            return
+
+        try:
+            yield from self._execute("UNLISTEN {0};".format(channel))
+        except Exception:
+            # Start over with a fresh connection, that
+            # only listens the remaining channels.
+            log.error("Unable to unlisten %s", channel, exc_info=True, stack_info=False)
+            self._connection_lost()
+
+    def close(self):
+        if self._reconnecting:
+            self._reconnecting.cancel()
+        if self.cnn is not None:
+            self.loop.remove_reader(self.cnn.fileno())
+            self.cnn.close()
+            self.cnn = None
+
+    @asyncio.coroutine
+    def _ensure_connection(self):
+        if self.cnn is not None:
+            return
+
+        self.cnn = yield from pg.connect(dsn=self.dsn, loop=self.loop)
+        self.loop.add_reader(self.cnn.fileno(), self._on_readable)
+
+    @asyncio.coroutine
+    def _execute(self, sql:str):
+        # pg.wait registers its own callbacks for the connection
+        # file descriptor, so the notifications reader is detached
+        # while the statement is running.
+        fd = self.cnn.fileno()
+        self.loop.remove_reader(fd)
+
+        try:
+            with self.cnn.cursor() as c:
+                yield from c.execute(sql)
+        finally:
+            self.loop.add_reader(fd, self._on_readable)
+
+        # Notifications may be read while waiting for the result
+        self._dispatch()
+
+    def _on_readable(self):
+        try:
+            self.cnn.poll()
+        except Exception:
+            log.error("Listen connection lost", exc_info=True, stack_info=False)
+            self._connection_lost()
+            return
+
+        self._dispatch()
+
+    def _dispatch(self):
+        notifies = _drain_notifies(self.cnn)
+        if not notifies:
+            return
+
+        # Group the whole burst by channel, keeping arrival order,
+        # and hand each channel its batch in one step.
+        batches = {}
+        for notify in notifies:
+            if notify.channel not in self.channels:
+                continue
+
+            # A malformed payload never drops the rest of the burst
+            message = _decode_notify(notify)
+            if message is None:
+                continue
+
+            batches.setdefault(notify.channel, []).append(message)
+
+        for channel, batch in batches.items():
+            for queue in self.channels[channel]:
+                base.put_message(queue, batch, origin="pg", routing_key=channel)
+
+    def _connection_lost(self):
+        self.loop.remove_reader(self.cnn.fileno())
+        try:
+            self.cnn.close()
+        except Exception:
+            pass
+
+        self.cnn = None
+        if self._reconnecting is None:
+            self._reconnecting = asyncio.Task(self._reconnect())
+
+    @asyncio.coroutine
+    def _reconnect(self):
+        try:
+            while True:
+                yield from asyncio.sleep(self.reconnect_delay)
+                with (yield from self._lock):
+                    try:
+                        yield from self._ensure_connection()
+                        for channel in self.channels:
+                            yield from self._execute("LISTEN {0};".format(channel))
+                        break
+                    except Exception:
+                        log.error("Unable to restore listen connection",
+                                  exc_info=True, stack_info=False)
+                        if self.cnn is not None:
+                            self.loop.remove_reader(self.cnn.fileno())
+                            self.cnn.close()
+                            self.cnn = None
+        finally:
+            self._reconnecting = None
+
+
+class MultiplexedEventsQueue(base.EventsQueue):
+    """
+    Public abstraction that shares a small fixed number of
+    postgresql connections between all subscriptions of the
+    process, issuing LISTEN/UNLISTEN as channels gain or lose
+    subscribers.
+    """
+
+    # LISTEN only accepts literal channel names
+    supports_patterns = False
+
+    def __init__(self, dsn, connections:int=1):
+        assert connections > 0, "at least one listen connection is required"
+        self.dsn = dsn
+        self.listeners = [Listener(dsn) for x in range(connections)]
+
+    @property
+    def connection_count(self) -> int:
+        return sum(1 for listener in self.listeners if listener.cnn is not None)
+
+    @asyncio.coroutine
+    def warm(self):
+        for listener in self.listeners:
+            yield from listener.connect()
+
+    def _get_listener(self, channel:str) -> Listener:
+        return self.listeners[hash(channel) % len(self.listeners)]
+
+    @asyncio.coroutine
+    def subscribe(self, routing_key:str, buffer_size:int=10):
+        channel = _channel_name(routing_key)
+        listener = self._get_listener(channel)
+        queue = RingBuffer(buffer_size)
+
+        yield from listener.listen(channel, queue)
+        return MultiplexedSubscription(listener, channel, queue, deque())
+
+    @asyncio.coroutine
+    def close_subscription(self, subscription):
+        assert isinstance(subscription, MultiplexedSubscription)
+
+        listener, channel, queue, pending = subscription
+        yield from listener.unlisten(channel, queue)
+
+    @asyncio.coroutine
+    def close(self):
+        for listener in self.listeners:
+            listener.close()
+
+    @asyncio.coroutine
+    def consume_message(self, subscription):
+        assert isinstance(subscription, MultiplexedSubscription)
+        return (yield from _consume_pending(subscription.queue, subscription.pending))
@@ -2,31 +2,78 @@ import traceback
 import sys
 import amqp
 import asyncio
+import select
 import socket
 import logging
-import json
 
 from collections import namedtuple
 from urllib.parse import urlparse
 
 from taiga_events.queues import base
+from taiga_events.utils.ringbuffer import RingBuffer
+from taiga_events.utils.topics import TopicTrie
+from taiga_events.messages import Message
 
 log = logging.getLogger("taiga.rabbitmq")
 
 ## Custom types definition
 
-RabbitSubscription = namedtuple("RabbitSubscription", ["conn", "queue", "rcvloop"])
+RabbitSubscription = namedtuple("RabbitSubscription", ["conn", "channel", "queue_name",
+                                                       "routing_key", "queue"])
+MultiplexedSubscription = namedtuple("MultiplexedSubscription", ["routing_key", "queue"])
 
 ## Low level RabbitMQ connection primitives adapted
 ## for work with asyncio
 
+def _is_readable(sock) -> bool:
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+
+def _has_pending_methods(conn) -> bool:
+    """
+    Synchronous channel operations may read frames of other
+    channels and keep them queued until next drain_events call.
+    """
+    return any(channel.method_queue for channel in conn.channels.values())
+
+
+def _decode_message(m, routing_key:str) -> Message:
+    """
+    Build the message of a delivery, or return None if its body
+    is malformed. Deliveries are decoded while draining the shared
+    connection, so a bad body must never reach the drain loop.
+    """
+    try:
+        return Message(m.body, routing_key)
+    except Exception:
+        log.error("Invalid payload delivered for %s: %r", routing_key, m.body,
+                  exc_info=True, stack_info=False)
+        return None
+
+
 class ConnectionManager(object):
-    def __init__(self, url):
+    """
+    Shares one amqp connection and drains its frames from
+    the asyncio loop only when its socket is readable.
+    """
+
+    def __init__(self, url, *, drain_timeout:float=0.01, loop=None):
         log.debug("Initializing RabbitMQ connection manager.")
 
         self.url = url
+        self.drain_timeout = drain_timeout
+        self.loop = loop or asyncio.get_event_loop()
         self._connection = None
         self._refcounter = 0
+        self._lost_callbacks = set()
+
+        # Connection kept open without references
+        self._held = False
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
 
     def _make_connection(self):
         parse_result = urlparse(self.url)
@@ -48,8 +95,22 @@ class ConnectionManager(object):
 
     def acquire(self):
         self._refcounter += 1
+        return self._ensure_connection()
+
+    def hold(self):
+        """
+        Keep the shared connection open until the manager is
+        closed, reopening it on next acquire if it is lost.
+        """
+        if not self._held:
+            self._held = True
+            self._refcounter += 1
+        return self._ensure_connection()
+
+    def _ensure_connection(self):
         if not self._connection:
             self._connection = self._make_connection()
+            self.loop.add_reader(self._connection.sock.fileno(), self.drain)
         return self._connection
 
     def release(self, connection):
@@ -58,9 +119,84 @@ class ConnectionManager(object):
 
         self._refcounter -= 1
         if self._refcounter == 0:
+            self.loop.remove_reader(self._connection.sock.fileno())
             self._connection.close()
             self._connection = None
 
+    def add_lost_callback(self, callback):
+        """
+        Call `callback(exc)` if the current
+        connection is lost.
+        """
+        self._lost_callbacks.add(callback)
+
+    def remove_lost_callback(self, callback):
+        self._lost_callbacks.discard(callback)
+
+    def close(self):
+        self._lost_callbacks.clear()
+        self._held = False
+        self._refcounter = 0
+        if self._connection is None:
+            return
+
+        self.loop.remove_reader(self._connection.sock.fileno())
+        try:
+            self._connection.close()
+        except Exception:
+            log.error("Unhandled exception", exc_info=True)
+
+        self._connection = None
+
+    def drain(self):
+        """
+        Dispatch all frames available without waiting for
+        new ones, so the loop is never blocked by the broker.
+        """
+        conn = self._connection
+        if conn is None:
+            return
+
+        try:
+            while True:
+                conn.drain_events(timeout=self.drain_timeout)
+                if not (_has_pending_methods(conn) or _is_readable(conn.sock)):
+                    break
+
+        except socket.timeout:
+            # Raised by drain_events when a frame is not
+            # completely received yet, the rest of it will
+            # be read on next readable event.
+            pass
+
+        except Exception as e:
+            log.error("RabbitMQ connection lost", exc_info=True)
+            self._connection_lost(e)
+
+    def _connection_lost(self, exc:Exception):
+        conn, self._connection = self._connection, None
+
+        # References of the lost connection are gone,
+        # the held one applies to the next connection.
+        self._refcounter = int(self._held)
+
+        try:
+            self.loop.remove_reader(conn.sock.fileno())
+        except Exception:
+            pass
+
+        # Tear down the transport without the close
+        # handshake, the broker is not reachable.
+        try:
+            conn._do_close()
+        except Exception:
+            pass
+
+        # A new connection is opened by the next acquire
+        callbacks, self._lost_callbacks = self._lost_callbacks, set()
+        for callback in callbacks:
+            callback(exc)
+
 
 class EventsQueue(base.EventsQueue):
     """
@@ -69,20 +205,25 @@ class EventsQueue(base.EventsQueue):
     def __init__(self, url):
         self.connection_manager = ConnectionManager(url)
 
+    @property
+    def connection_count(self) -> int:
+        return int(self.connection_manager.connected)
+
+    @asyncio.coroutine
+    def warm(self):
+        # The shared connection outlives its subscriptions
+        # for the process lifetime, also after reconnecting.
+        conn = self.connection_manager.hold()
+        conn.channel().close()
+
     @asyncio.coroutine
     def subscribe(self, routing_key:str, buffer_size:int=10):
         # Message buffer
-        queue = asyncio.Queue(buffer_size)
+        queue = RingBuffer(buffer_size)
 
         # RabbitMQ connection
         conn = self.connection_manager.acquire()
 
-        # Run message receiver
-        rcvloop = asyncio.Task(self._receive_messages_loop(conn, routing_key, queue))
-        return RabbitSubscription(conn, queue, rcvloop)
-
-    @asyncio.coroutine
-    def _receive_messages_loop(self, conn, routing_key, queue):
         channel = conn.channel()
         channel.exchange_declare("events", "topic", auto_delete=True)
 
@@ -90,36 +231,17 @@ class EventsQueue(base.EventsQueue):
         channel.queue_bind(queue_name, "events", routing_key=routing_key)
 
         def receive_cb(m):
-            asyncio.Task(queue.put(json.loads(m.body)))
-
-        try:
-            channel.basic_consume(queue_name, callback=receive_cb)
-
-            while True:
-                try:
-                    yield from asyncio.sleep(1)
-                    conn.drain_events(timeout=0.2)
-                except socket.timeout:
-                    # This events is raised by conn.drain_events
-                    # and should be explictly ignored
-                    pass
-
-        except asyncio.CancelledError:
-            # This happens when browser closes the conection
-            # and we should stop a loop when it happens
-            pass
+            message = _decode_message(m, m.delivery_info["routing_key"])
+            if message is not None:
+                base.put_message(queue, message, origin="rabbitmq", routing_key=routing_key)
 
-        except KeyboardInterrupt:
-            # This can happens when user explicitly terminate
-            # the execution and should be ignored
-            pass
+        channel.basic_consume(queue_name, callback=receive_cb, no_ack=True)
+        self.connection_manager.add_lost_callback(queue.fail)
 
-        except Exception:
-            log.error("Unhandled exception", exc_info=True)
-
-        finally:
-            channel.queue_unbind(queue_name, exchange="events")
-            channel.close()
+        # Frames read while declaring the channel are
+        # dispatched as soon as possible.
+        asyncio.get_event_loop().call_soon(self.connection_manager.drain)
+        return RabbitSubscription(conn, channel, queue_name, routing_key, queue)
 
     @asyncio.coroutine
     def close_subscription(self, subscription):
@@ -127,13 +249,22 @@ class EventsQueue(base.EventsQueue):
         Given a subscription, close a related
         rabbitmq queues and connection.
         """
-        (rconn, queue, rcvloop) = subscription
+        (rconn, channel, queue_name, routing_key, queue) = subscription
+        self.connection_manager.remove_lost_callback(queue.fail)
 
-        def done_callback(n):
+        try:
+            # Channels of a lost connection are already closed
+            if channel.is_open:
+                channel.queue_unbind(queue_name, exchange="events", routing_key=routing_key)
+                channel.close()
+        except Exception:
+            log.error("Unhandled exception", exc_info=True)
+        finally:
             self.connection_manager.release(rconn)
 
-        rcvloop.cancel()
-        rcvloop.add_done_callback(done_callback)
+    @asyncio.coroutine
+    def close(self):
+        self.connection_manager.close()
 
     @asyncio.coroutine
     def consume_message(self, subscription):
@@ -144,3 +275,130 @@ class EventsQueue(base.EventsQueue):
         """
         return (yield from subscription.queue.get())
 
+
+class MultiplexedEventsQueue(base.EventsQueue):
+    """
+    Public abstraction that owns one consumer channel and one
+    exclusive queue per process. Routing keys are bound and
+    unbound as they gain or lose local subscribers, and
+    deliveries are routed locally by its routing key, matched
+    against the bound patterns.
+    """
+    def __init__(self, url):
+        self.connection_manager = ConnectionManager(url)
+        self.bindings = {}
+        self.router = TopicTrie()
+
+        self._conn = None
+        self._channel = None
+        self._queue_name = None
+
+    @property
+    def connection_count(self) -> int:
+        return int(self.connection_manager.connected)
+
+    @asyncio.coroutine
+    def warm(self):
+        self._ensure_channel()
+
+    def _ensure_channel(self):
+        if self._channel is not None:
+            return
+
+        conn = self.connection_manager.acquire()
+        try:
+            channel = conn.channel()
+            channel.exchange_declare("events", "topic", auto_delete=True)
+
+            queue_name, _, _ = channel.queue_declare(exclusive=True)
+            channel.basic_consume(queue_name, callback=self._receive_cb, no_ack=True)
+        except Exception:
+            self.connection_manager.release(conn)
+            raise
+
+        self._conn = conn
+        self._channel = channel
+        self._queue_name = queue_name
+        self.connection_manager.add_lost_callback(self._connection_lost)
+
+    def _connection_lost(self, exc:Exception):
+        # Subscribers are failed, and bindings are made again
+        # on a new channel when routing keys are subscribed.
+        bindings, self.bindings = self.bindings, {}
+        self.router = TopicTrie()
+        self._conn = None
+        self._channel = None
+        self._queue_name = None
+
+        for queues in bindings.values():
+            for queue in queues:
+                queue.fail(exc)
+
+    def _receive_cb(self, m):
+        routing_key = m.delivery_info["routing_key"]
+        queues = self.router.match(routing_key)
+        if not queues:
+            return
+
+        message = _decode_message(m, routing_key)
+        if message is None:
+            return
+
+        for queue in queues:
+            base.put_message(queue, message, origin="rabbitmq", routing_key=routing_key)
+
+    @asyncio.coroutine
+    def subscribe(self, routing_key:str, buffer_size:int=10):
+        self._ensure_channel()
+        queue = RingBuffer(buffer_size)
+
+        if routing_key not in self.bindings:
+            self._channel.queue_bind(self._queue_name, "events", routing_key=routing_key)
+            self.bindings[routing_key] = set()
+
+            # Frames read while binding are dispatched
+            # as soon as possible.
+            asyncio.get_event_loop().call_soon(self.connection_manager.drain)
+
+        self.bindings[routing_key].add(queue)
+        self.router.add(routing_key, queue)
+        return MultiplexedSubscription(routing_key, queue)
+
+    @asyncio.coroutine
+    def close_subscription(self, subscription):
+        assert isinstance(subscription, MultiplexedSubscription)
+
+        routing_key, queue = subscription
+        queues = self.bindings.get(routing_key, None)
+        if queues is None:
+            return
+
+        self.router.remove(routing_key, queue)
+        queues.discard(queue)
+        if queues:
+            return
+
+        del self.bindings[routing_key]
+        try:
+            self._channel.queue_unbind(self._queue_name, exchange="events",
+                                       routing_key=routing_key)
+        except Exception:
+            log.error("Unhandled exception", exc_info=True)
+
+    @asyncio.coroutine
+    def close(self):
+        if self._channel is not None:
+            try:
+                self._channel.close()
+            except Exception:
+                log.error("Unhandled exception", exc_info=True)
+
+        self._channel = None
+        self.bindings = {}
+        self.router = TopicTrie()
+        self.connection_manager.close()
+
+    @asyncio.coroutine
+    def consume_message(self, subscription):
+        assert isinstance(subscription, MultiplexedSubscription)
+        return (yield from subscription.queue.get())
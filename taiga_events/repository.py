@@ -4,7 +4,9 @@ from collections import namedtuple
 from . import types
 from .utils import pg
 
-Connection = namedtuple("Repository", ["connection", "vendor"])
+Connection = namedtuple("Connection", ["connection", "vendor"])
+Repository = namedtuple("Repository", ["pool", "vendor"])
+
 
 @asyncio.coroutine
 def get_connection(conf:dict) -> Connection:
@@ -13,8 +15,20 @@ def get_connection(conf:dict) -> Connection:
     return Connection(connection, "postgresql")
 
 
+def make_repository(conf:dict) -> Repository:
+    """
+    Given an application configuration, return a repository
+    backed by a pool of connections. Pool options are taken
+    from the optional "pool" key of repo_conf.
+    """
+    repo_conf = conf["repo_conf"]
+    pool_conf = repo_conf.get("pool", None) or {}
+    pool = pg.Pool(repo_conf["kwargs"]["dsn"], **pool_conf)
+    return Repository(pool, "postgresql")
+
+
 @asyncio.coroutine
-def get_user_project_id_list(repo:Connection, user_id:int) -> [int]:
+def get_user_project_id_list(repo:Repository, user_id:int) -> [int]:
     """
     Given an repository instance and user id, return all project
     id's associated with that user.
@@ -24,6 +38,7 @@ def get_user_project_id_list(repo:Connection, user_id:int) -> [int]:
     sql = ("select project_id from projects_membership "
            "where user_id = %s;")
 
-    with repo.connection.cursor() as cur:
-        yield from cur.execute(sql, [user_id])
-        return [x[0] for x in cur.fetchall()]
+    with (yield from repo.pool.connection()) as cnn:
+        with cnn.cursor() as cur:
+            yield from cur.execute(sql, [user_id])
+            return [x[0] for x in cur.fetchall()]
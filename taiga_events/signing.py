@@ -39,7 +39,7 @@ import time
 import zlib
 
 from .utils import baseconv
-from .utils.crypto import constant_time_compare, salted_hmac
+from .utils.crypto import constant_time_compare, salted_hmac, salted_hmac_template
 from .utils.encoding import force_bytes, force_text
 
 
@@ -141,10 +141,17 @@ class Signer(object):
         self.salt = force_text(salt or
             '%s.%s' % (self.__class__.__module__, self.__class__.__name__))
 
+        # Pre-keyed hmac, copied for every signature
+        self._hmac = salted_hmac_template(self.salt + 'signer', self.key)
+
+    def _signature(self, value:str) -> bytes:
+        mac = self._hmac.copy()
+        mac.update(value.encode("utf-8"))
+        return b64_encode(mac.digest())
+
     def signature(self, value):
-        signature = base64_hmac(self.salt + 'signer', value, self.key)
         # Convert the signature from bytes to str only on Python 3
-        return force_text(signature)
+        return self._signature(force_text(value)).decode("ascii")
 
     def sign(self, value):
         value = force_text(value)
@@ -156,9 +163,8 @@ class Signer(object):
             raise BadSignature('No "%s" found in value' % self.sep)
         value, sig = signed_value.rsplit(self.sep, 1)
 
-        if constant_time_compare(force_bytes(sig),
-                                 force_bytes(self.signature(value))):
-            return force_text(value)
+        if constant_time_compare(sig.encode("utf-8"), self._signature(value)):
+            return value
         raise BadSignature('Signature "%s" does not match' % sig)
 
 
@@ -0,0 +1,62 @@
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded least recently used cache with optional
+    time to live for its entries.
+
+    Lookups are accounted in `hits` and `misses`.
+    """
+
+    def __init__(self, maxsize:int=1024, ttl:float=None, *, timer=time.monotonic):
+        assert maxsize > 0, "cache size should be positive"
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._timer = timer
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key, None)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires, value = item
+        if expires is not None and expires <= self._timer():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = self._timer() + self.ttl
+
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
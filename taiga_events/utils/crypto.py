@@ -1,6 +1,7 @@
 # This file contains code taken from django
 # and it follows django license
 
+import functools
 import hmac
 import hashlib
 
@@ -20,14 +21,17 @@ def constant_time_compare(val1, val2):
     assert isinstance(val1, bytes)
     assert isinstance(val2, bytes)
 
-    if len(val1) != len(val2):
-        return False
+    return hmac.compare_digest(val1, val2)
 
-    result = 0
-    for x, y in zip(val1, val2):
-        result |= x ^ y
 
-    return result == 0
+@functools.lru_cache(maxsize=64)
+def derive_key(key_salt:bytes, secret:bytes) -> bytes:
+    """
+    Returns the key derived from key_salt and secret. There are only
+    a handful of (salt, secret) pairs in use, so keys are kept
+    precomputed instead of hashed on every signature.
+    """
+    return hashlib.sha1(key_salt + secret).digest()
 
 
 def salted_hmac(key_salt, value, secret):
@@ -44,10 +48,21 @@ def salted_hmac(key_salt, value, secret):
     # We need to generate a derived key from our base key.  We can do this by
     # passing the key_salt and our base key through a pseudo-random function and
     # SHA1 works nicely.
-    key = hashlib.sha1(key_salt + secret).digest()
+    key = derive_key(key_salt, secret)
 
     # If len(key_salt + secret) > sha_constructor().block_size, the above
     # line is redundant and could be replaced by key = key_salt + secret, since
     # the hmac module does the same thing for keys longer than the block size.
     # However, we need to ensure that we *always* do this.
     return hmac.new(key, msg=force_bytes(value), digestmod=hashlib.sha1)
+
+
+@functools.lru_cache(maxsize=64)
+def salted_hmac_template(key_salt, secret):
+    """
+    Returns an HMAC-SHA1 object keyed as salted_hmac does but without
+    any message. It is shared, so it should never be updated: use
+    a .copy() of it for every signature.
+    """
+    key = derive_key(force_bytes(key_salt), force_bytes(secret))
+    return hmac.new(key, digestmod=hashlib.sha1)
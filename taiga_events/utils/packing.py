@@ -0,0 +1,97 @@
+"""
+MessagePack helpers for the binary wire encoding.
+
+Packing and unpacking whole objects needs the optional msgpack
+package. Headers are built and parsed here, so already packed
+maps and arrays can be extended or bundled without decoding
+and encoding them again.
+"""
+
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def is_available() -> bool:
+    return msgpack is not None
+
+
+if msgpack is not None and msgpack.version >= (0, 5, 2):
+    _UNPACK_OPTIONS = {"raw": False}
+else:
+    _UNPACK_OPTIONS = {"encoding": "utf-8"}
+
+
+def packb(obj) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpackb(data:bytes):
+    return msgpack.unpackb(data, **_UNPACK_OPTIONS)
+
+
+def is_map(data:bytes) -> bool:
+    """
+    Check if data starts with a packed map header.
+    """
+    if not isinstance(data, bytes) or not data:
+        return False
+    return 0x80 <= data[0] <= 0x8f or data[0] in (0xde, 0xdf)
+
+
+def map_header(size:int) -> bytes:
+    if size < 16:
+        return struct.pack("B", 0x80 | size)
+    if size <= 0xFFFF:
+        return struct.pack("!BH", 0xde, size)
+    return struct.pack("!BI", 0xdf, size)
+
+
+def array_header(size:int) -> bytes:
+    if size < 16:
+        return struct.pack("B", 0x90 | size)
+    if size <= 0xFFFF:
+        return struct.pack("!BH", 0xdc, size)
+    return struct.pack("!BI", 0xdd, size)
+
+
+def _parse_map_header(data:bytes) -> (int, int):
+    """
+    Return the number of items of a packed map
+    and the offset where they start.
+    """
+    if 0x80 <= data[0] <= 0x8f:
+        return data[0] & 0x0f, 1
+    if data[0] == 0xde:
+        return struct.unpack_from("!H", data, 1)[0], 3
+    if data[0] == 0xdf:
+        return struct.unpack_from("!I", data, 1)[0], 5
+    raise ValueError("Data is not a packed map")
+
+
+def pack_str(value:str) -> bytes:
+    data = value.encode("utf-8")
+    length = len(data)
+
+    if length < 32:
+        header = struct.pack("B", 0xa0 | length)
+    elif length <= 0xFF:
+        header = struct.pack("BB", 0xd9, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BH", 0xda, length)
+    else:
+        header = struct.pack("!BI", 0xdb, length)
+    return header + data
+
+
+def add_str_item(packed_map:bytes, key:str, value:str) -> bytes:
+    """
+    Given a packed map, return it with one more string item
+    appended. Existing items are copied as they are.
+    """
+    size, offset = _parse_map_header(packed_map)
+    return b"".join((map_header(size + 1), packed_map[offset:],
+                     pack_str(key), pack_str(value)))
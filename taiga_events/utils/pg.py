@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import functools
 
 import psycopg2
@@ -87,3 +88,224 @@ def connect(dsn=None, *, loop=None):
 
     yield from wait(conn, loop)
     return conn
+
+
+class PoolTimeout(Exception):
+    """
+    No connection could be acquired from the pool
+    within the acquire timeout.
+    """
+    pass
+
+
+class _ConnectionContext(object):
+    """
+    Acquires a pool connection and releases it on exit. Usable
+    either as `with (yield from pool.connection()) as cnn:`
+    or as `async with pool.connection() as cnn:`.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._cnn = None
+
+    def __iter__(self):
+        self._cnn = yield from self._pool.acquire()
+        return self
+
+    def __enter__(self):
+        return self._cnn
+
+    def __exit__(self, *exc_info):
+        cnn, self._cnn = self._cnn, None
+        self._pool.release(cnn)
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        self._cnn = yield from self._pool.acquire()
+        return self._cnn
+
+    @asyncio.coroutine
+    def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class Pool(object):
+    """
+    Pool of asynchronous postgresql connections.
+
+    Keeps between `minsize` and `maxsize` connections. Idle
+    connections over `minsize` are closed after `idle_timeout`
+    seconds, and connections idle for more than
+    `health_check_interval` seconds are checked before being
+    handed out again.
+    """
+
+    def __init__(self, dsn:str, *, minsize:int=1, maxsize:int=10,
+                 idle_timeout:float=300, acquire_timeout:float=5,
+                 health_check_interval:float=30, loop=None):
+        assert 0 <= minsize <= maxsize, "invalid pool size"
+
+        self.dsn = dsn
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._free = []
+        self._used = set()
+        self._waiters = collections.deque()
+        self._connecting = 0
+        self._checking = 0
+        self._created = 0
+        self._reaper = None
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return len(self._free) + len(self._used) + self._connecting + self._checking
+
+    def stats(self) -> dict:
+        return {"size": self.size,
+                "free": len(self._free),
+                "in_use": len(self._used),
+                "waiting": len(self._waiters),
+                "created": self._created}
+
+    def connection(self) -> _ConnectionContext:
+        return _ConnectionContext(self)
+
+    @asyncio.coroutine
+    def fill(self):
+        """
+        Open connections until `minsize` is reached.
+        """
+        while self.size < self.minsize:
+            cnn = yield from self._connect()
+            self._release_free(cnn)
+
+    @asyncio.coroutine
+    def acquire(self):
+        assert not self._closed, "pool is closed"
+        deadline = self._loop.time() + self.acquire_timeout
+
+        while True:
+            while self._free:
+                cnn, released_at = self._free.pop()
+
+                # Still counted in the pool size while checked
+                self._checking += 1
+                try:
+                    healthy = yield from self._is_healthy(cnn, released_at)
+                finally:
+                    self._checking -= 1
+
+                if healthy:
+                    self._used.add(cnn)
+                    return cnn
+
+            if self.size < self.maxsize:
+                cnn = yield from self._connect()
+                self._used.add(cnn)
+                return cnn
+
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                raise PoolTimeout("Timeout acquiring a database connection")
+
+            waiter = asyncio.Future(loop=self._loop)
+            self._waiters.append(waiter)
+            try:
+                yield from asyncio.wait_for(waiter, timeout, loop=self._loop)
+            except asyncio.TimeoutError:
+                raise PoolTimeout("Timeout acquiring a database connection")
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def release(self, cnn):
+        self._used.discard(cnn)
+
+        if self._closed or cnn.closed:
+            cnn.close()
+        elif cnn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Connection left in the middle of a query
+            cnn.close()
+        else:
+            self._release_free(cnn)
+
+        self._wakeup()
+
+    def close(self):
+        self._closed = True
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+        for cnn, released_at in self._free:
+            cnn.close()
+        self._free = []
+
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_exception(PoolTimeout("Pool closed"))
+
+    @asyncio.coroutine
+    def _connect(self):
+        self._connecting += 1
+        try:
+            cnn = yield from connect(self.dsn, loop=self._loop)
+        except Exception:
+            # Let a waiter retry with the freed slot
+            self._wakeup()
+            raise
+        finally:
+            self._connecting -= 1
+
+        self._created += 1
+        return cnn
+
+    @asyncio.coroutine
+    def _is_healthy(self, cnn, released_at:float) -> bool:
+        if cnn.closed:
+            return False
+
+        if self._loop.time() - released_at < self.health_check_interval:
+            return True
+
+        try:
+            with cnn.cursor() as cur:
+                yield from cur.execute("SELECT 1;")
+            return True
+        except Exception:
+            cnn.close()
+            return False
+
+    def _release_free(self, cnn):
+        self._free.append((cnn, self._loop.time()))
+        if self._reaper is None and self.idle_timeout is not None:
+            self._reaper = self._loop.call_later(self.idle_timeout, self._reap)
+
+    def _wakeup(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _reap(self):
+        self._reaper = None
+        now = self._loop.time()
+
+        # Free list is ordered by release time, oldest first
+        while self._free and self.size > self.minsize:
+            cnn, released_at = self._free[0]
+            if now - released_at < self.idle_timeout:
+                break
+            del self._free[0]
+            cnn.close()
+
+        if self._free:
+            self._reaper = self._loop.call_later(self.idle_timeout, self._reap)
@@ -0,0 +1,77 @@
+import asyncio
+
+from collections import deque
+
+
+class RingBuffer(object):
+    """
+    Fixed size message buffer between a producer that never
+    waits and a single consumer coroutine.
+
+    Pushing to a full buffer overwrites its oldest item in O(1)
+    and accounts it in `dropped`.
+    """
+
+    def __init__(self, size:int, *, loop=None):
+        assert size > 0, "ring buffer size should be positive"
+
+        self._items = deque(maxlen=size)
+        self._loop = loop or asyncio.get_event_loop()
+        self._waiter = None
+        self._error = None
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def maxsize(self) -> int:
+        return self._items.maxlen
+
+    def push(self, item) -> bool:
+        """
+        Append an item waking up the consumer if it is waiting.
+        Return False if the oldest item has been overwritten.
+        """
+        overwritten = len(self._items) == self._items.maxlen
+        self._items.append(item)
+
+        if overwritten:
+            self.dropped += 1
+
+        self._wakeup()
+        return not overwritten
+
+    def fail(self, exc:Exception):
+        """
+        Make the consumer raise the given exception
+        once the remaining items are consumed.
+        """
+        self._error = exc
+        self._wakeup()
+
+    def get_nowait(self):
+        if not self._items:
+            raise IndexError("ring buffer is empty")
+        return self._items.popleft()
+
+    @asyncio.coroutine
+    def get(self):
+        """
+        Remove and return the oldest item, waiting
+        until one is available.
+        """
+        while not self._items:
+            if self._error is not None:
+                raise self._error
+            if self._waiter is None or self._waiter.done():
+                self._waiter = asyncio.Future(loop=self._loop)
+            yield from self._waiter
+        return self._items.popleft()
+
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
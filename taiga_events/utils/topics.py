@@ -0,0 +1,101 @@
+"""
+AMQP style topic patterns.
+
+Routing keys are made of words separated by dots. In patterns
+"*" matches exactly one word and "#" matches zero or more words.
+"""
+
+SINGLE_WORD = "*"
+MULTIPLE_WORDS = "#"
+
+
+def is_pattern(routing_key:str) -> bool:
+    return any(word in (SINGLE_WORD, MULTIPLE_WORDS) for word in routing_key.split("."))
+
+
+class _Node(object):
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = set()
+
+
+class TopicTrie(object):
+    """
+    Index of topic patterns by word. Matching a routing key
+    walks the trie word by word, so its cost depends on the
+    key depth and not on the number of indexed values.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, pattern:str, value):
+        node = self._root
+        for word in pattern.split("."):
+            node = node.children.setdefault(word, _Node())
+
+        if value not in node.values:
+            node.values.add(value)
+            self._size += 1
+
+    def remove(self, pattern:str, value):
+        path = [self._root]
+        words = pattern.split(".")
+
+        for word in words:
+            node = path[-1].children.get(word, None)
+            if node is None:
+                return
+            path.append(node)
+
+        if value not in path[-1].values:
+            return
+
+        path[-1].values.discard(value)
+        self._size -= 1
+
+        # Prune branches left empty
+        for index in range(len(words), 0, -1):
+            node = path[index]
+            if node.values or node.children:
+                break
+            del path[index - 1].children[words[index - 1]]
+
+    def match(self, routing_key:str) -> set:
+        """
+        Return the values of all patterns matching
+        the given routing key.
+        """
+        words = routing_key.split(".")
+        result = set()
+        self._match(self._root, words, 0, result)
+        return result
+
+    def _match(self, node:_Node, words:list, index:int, result:set):
+        if index == len(words):
+            result.update(node.values)
+
+            # "#" may match zero words at the end
+            tail = node.children.get(MULTIPLE_WORDS, None)
+            if tail is not None:
+                self._match(tail, words, index, result)
+            return
+
+        child = node.children.get(words[index], None)
+        if child is not None:
+            self._match(child, words, index + 1, result)
+
+        child = node.children.get(SINGLE_WORD, None)
+        if child is not None:
+            self._match(child, words, index + 1, result)
+
+        child = node.children.get(MULTIPLE_WORDS, None)
+        if child is not None:
+            for next_index in range(index, len(words) + 1):
+                self._match(child, words, next_index, result)
@@ -1,29 +1,355 @@
 import abc
+import asyncio
+import struct
+import zlib
+
+from collections import Counter, deque
+
+from .utils import packing
+
+# Slow consumer policies, applied when the outbound
+# buffer of a connection exceeds its limits.
+DROP_OLDEST = "drop-oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# Close code sent to disconnected slow consumers
+# (1008: policy violation).
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+# How many times each policy has been applied, and
+# how many messages have been discarded by them.
+overflow_stats = Counter()
+
+
+# Frame header bit of compressed messages (RFC 7692)
+RSV1 = 0x40
+
+
+def encode_frame(data:bytes, opcode:int=0x1, flags:int=0) -> bytes:
+    """
+    Build a final and unmasked websocket frame (RFC 6455),
+    as sent from server to client.
+    """
+    finbit = 0x80
+    length = len(data)
+
+    if length < 126:
+        header = struct.pack("BB", finbit | flags | opcode, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BBH", finbit | flags | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", finbit | flags | opcode, 127, length)
+
+    return header + data
+
+
+def deflate(data:bytes, *, max_wbits:int=zlib.MAX_WBITS,
+            level:int=zlib.Z_DEFAULT_COMPRESSION) -> bytes:
+    """
+    Compress a message payload as permessage-deflate (RFC 7692)
+    without context takeover, so the result is valid for any
+    connection that negotiated it.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -max_wbits)
+    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    assert data.endswith(b"\x00\x00\xff\xff")
+    return data[:-4]
+
+
+def force_server_no_context_takeover(extensions:str) -> str:
+    """
+    Given a Sec-WebSocket-Extensions request header, add the
+    server_no_context_takeover parameter to its first
+    permessage-deflate offer. Servers may accept an offer
+    with it even if the client didn't ask for it.
+    """
+    offers = [offer.strip() for offer in extensions.split(",")]
+    for index, offer in enumerate(offers):
+        params = [param.strip() for param in offer.split(";")]
+        if params[0] == "permessage-deflate":
+            if "server_no_context_takeover" not in params:
+                offers[index] = offer + "; server_no_context_takeover"
+            break
+    return ", ".join(offers)
+
+
+class Frame(object):
+    """
+    Text message whose websocket frame is built once
+    and written as is to every recipient connection.
+    """
+
+    __slots__ = ("text", "_data", "_deflated")
+
+    binary = False
+    opcode = 0x1
+
+    def __init__(self, text:str):
+        self.text = text
+        self._data = None
+        self._deflated = None
+
+    def _payload(self) -> bytes:
+        return self.text.encode("utf-8")
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = encode_frame(self._payload(), self.opcode)
+        return self._data
+
+    def deflated_data(self, *, max_wbits:int=zlib.MAX_WBITS,
+                      level:int=zlib.Z_DEFAULT_COMPRESSION) -> bytes:
+        """
+        Return the compressed frame, built once for all
+        recipients with the same compression parameters.
+        """
+        if self._deflated is None:
+            self._deflated = {}
+
+        key = (max_wbits, level)
+        data = self._deflated.get(key, None)
+        if data is None:
+            payload = deflate(self._payload(), max_wbits=max_wbits, level=level)
+            data = self._deflated[key] = encode_frame(payload, self.opcode, RSV1)
+        return data
+
+
+class BinaryFrame(Frame):
+    """
+    Binary message whose websocket frame is built once
+    and written as is to every recipient connection.
+    """
+
+    __slots__ = ("payload",)
+
+    binary = True
+    opcode = 0x2
+
+    def __init__(self, payload:bytes):
+        super().__init__(None)
+        self.payload = payload
+
+    def _payload(self) -> bytes:
+        return self.payload
+
+
+def _message_size(message) -> int:
+    if isinstance(message, Frame):
+        return len(message.data)
+    return len(message)
 
 
 class WebSocketConnection(object):
     """
     Simple wrapper that works as abstraction for
     websocket connection.
+
+    Messages written while the transport is still sending
+    previous data are kept in a bounded outbound buffer. When
+    it exceeds `max_bytes` or `max_messages` the slow consumer
+    `policy` is applied.
     """
 
     @property
     def remote_ip(self):
         return self.handler.request.remote_ip
 
-    def __init__(self, handler):
+    @property
+    def outbound_bytes(self) -> int:
+        return self._outbox_bytes
+
+    @property
+    def outbound_messages(self) -> int:
+        return len(self._outbox)
+
+    def __init__(self, handler, *, max_bytes:int=2 * 1024 * 1024,
+                 max_messages:int=1000, policy:str=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError("Invalid slow consumer policy: {0}".format(policy))
+
         self.handler = handler
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.policy = policy
+
+        self._outbox = deque()
+        self._outbox_bytes = 0
 
-    def write(self, message:str):
+    def write(self, message, *, key=None):
+        """
+        Send a message (text or prebuilt frame). Messages written
+        with the same `key` may be collapsed into the newest one
+        by the coalesce policy.
+        """
+        if not self._outbox and not self.handler.is_writing():
+            return self._write_now(message)
+
+        if not self._outbox:
+            self.handler.on_drain(self._flush)
+
+        self._outbox.append((key, message))
+        self._outbox_bytes += _message_size(message)
+
+        if self._is_over_limits():
+            self._apply_policy()
+
+    def close(self, code:int=None, reason:str=None):
+        self._clear()
+        return self.handler.close(code, reason)
+
+    def _write_now(self, message):
+        if isinstance(message, Frame):
+            return self.handler.write_frame(message)
         return self.handler.write_message(message)
 
-    def close(self):
-        return self.handler.close()
+    def _flush(self):
+        outbox = self._outbox
+        self._clear()
+
+        for key, message in outbox:
+            try:
+                self._write_now(message)
+            except Exception:
+                # Connection closed in the meantime
+                break
+
+    def _clear(self):
+        self._outbox = deque()
+        self._outbox_bytes = 0
+
+    def _is_over_limits(self) -> bool:
+        if self.max_messages is not None and len(self._outbox) > self.max_messages:
+            return True
+        if self.max_bytes is not None and self._outbox_bytes > self.max_bytes:
+            return True
+        return False
+
+    def _drop_oldest(self):
+        key, message = self._outbox.popleft()
+        self._outbox_bytes -= _message_size(message)
+        overflow_stats["dropped_messages"] += 1
+
+    def _coalesce(self):
+        # Keep only the newest message of every key
+        seen = set()
+        kept = deque()
+
+        for key, message in reversed(self._outbox):
+            if key is not None:
+                if key in seen:
+                    self._outbox_bytes -= _message_size(message)
+                    overflow_stats["dropped_messages"] += 1
+                    continue
+                seen.add(key)
+            kept.appendleft((key, message))
+
+        self._outbox = kept
+
+    def _apply_policy(self):
+        overflow_stats[self.policy] += 1
+
+        if self.policy == DISCONNECT:
+            overflow_stats["dropped_messages"] += len(self._outbox)
+            self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+            return
+
+        if self.policy == COALESCE:
+            self._coalesce()
+
+        while self._outbox and self._is_over_limits():
+            self._drop_oldest()
+
+
+class BatchWriter(object):
+    """
+    Connection wrapper that bundles the messages written to
+    it in a single JSON array frame, sent when `max_messages`
+    are pending or after `max_delay` seconds. With no delay
+    pending messages are sent once per loop iteration.
+
+    Messages must be JSON texts (or frames of them). Binary
+    frames must hold MessagePack data, and are bundled in a
+    MessagePack array.
+    """
+
+    def __init__(self, ws:WebSocketConnection, *, max_delay:float=0,
+                 max_messages:int=100, loop=None):
+        self.ws = ws
+        self.max_delay = max_delay
+        self.max_messages = max_messages
+
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = []
+        self._binary = False
+        self._handle = None
+
+    @property
+    def remote_ip(self):
+        return self.ws.remote_ip
+
+    @property
+    def outbound_bytes(self) -> int:
+        return self.ws.outbound_bytes
+
+    @property
+    def outbound_messages(self) -> int:
+        return self.ws.outbound_messages + len(self._pending)
+
+    def write(self, message, *, key=None):
+        binary = isinstance(message, Frame) and message.binary
+
+        # Text and binary messages can't share a frame
+        if self._pending and binary != self._binary:
+            self.flush()
+        self._binary = binary
+
+        if isinstance(message, Frame):
+            message = message.payload if binary else message.text
+
+        self._pending.append(message)
+        if len(self._pending) >= self.max_messages:
+            self.flush()
+        elif self._handle is None:
+            if self.max_delay:
+                self._handle = self._loop.call_later(self.max_delay, self.flush)
+            else:
+                self._handle = self._loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        if self._binary:
+            frame = BinaryFrame(packing.array_header(len(pending)) + b"".join(pending))
+        else:
+            frame = Frame("[" + ",".join(pending) + "]")
+
+        try:
+            self.ws.write(frame)
+        except Exception:
+            # Connection closed in the meantime
+            pass
+
+    def close(self, code:int=None, reason:str=None):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._pending = []
+        return self.ws.close(code, reason)
 
 
 class WebSocketHandler(object, metaclass=abc.ABCMeta):
     @abc.abstractmethod
-    def on_initialize(self, config:dict):
+    def on_initialize(self, config:dict, **kwargs):
         pass
 
     @abc.abstractmethod
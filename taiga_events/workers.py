@@ -0,0 +1,96 @@
+import errno
+import logging
+import os
+import signal
+import sys
+import time
+
+log = logging.getLogger("taiga.workers")
+
+
+class Supervisor(object):
+    """
+    Pre-fork process supervisor.
+
+    Forks `count` worker processes running `target(sockets,
+    worker_id)`, all of them sharing the listening sockets bound
+    by the parent. Workers that die unexpectedly are restarted
+    with the same id. On SIGTERM or SIGINT all workers are sent
+    SIGTERM, so they drain their connections, and waited for.
+    """
+
+    # Workers dying faster than this are restarted
+    # with a delay, to avoid a restart loop.
+    min_uptime = 1
+
+    def __init__(self, count:int, target, sockets:list):
+        assert count > 0, "at least one worker is required"
+
+        self.count = count
+        self.target = target
+        self.sockets = sockets
+        self.workers = {}
+        self.stopping = False
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._forward_signal)
+        signal.signal(signal.SIGINT, self._forward_signal)
+
+        for worker_id in range(self.count):
+            self._spawn(worker_id)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except InterruptedError:
+                continue
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+
+            if pid not in self.workers:
+                continue
+
+            worker_id, started_at = self.workers.pop(pid)
+            if self.stopping:
+                continue
+
+            log.error("Worker %s (pid %s) exited with status %s, restarting",
+                      worker_id, pid, status)
+            if time.time() - started_at < self.min_uptime:
+                time.sleep(self.min_uptime)
+
+            if not self.stopping:
+                self._spawn(worker_id)
+
+        return 0
+
+    def _spawn(self, worker_id:int):
+        pid = os.fork()
+        if pid == 0:
+            # Worker process: SIGTERM drains it once the target
+            # installs its handler. Ctrl-C sends SIGINT to the whole
+            # process group, workers wait for the parent SIGTERM.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            status = 1
+            try:
+                status = self.target(self.sockets, worker_id) or 0
+            except Exception:
+                log.error("Unhandled exception in worker %s", worker_id, exc_info=True)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+
+        self.workers[pid] = (worker_id, time.time())
+
+    def _forward_signal(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def loop(request):
+    """
+    New event loop, set as the current one while the
+    test runs. The previous loop is restored afterwards.
+    """
+    try:
+        previous = asyncio.get_event_loop()
+    except RuntimeError:
+        previous = None
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    def restore():
+        asyncio.set_event_loop(previous)
+        loop.close()
+
+    request.addfinalizer(restore)
+    return loop
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+from taiga_events import auth
+from taiga_events import signing
+from taiga_events.utils.cache import LRUCache
+
+
+def test_lru_cache_bounded_size():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+def test_lru_cache_ttl():
+    now = [0]
+    cache = LRUCache(10, ttl=5, timer=lambda: now[0])
+    cache.set("a", 1)
+
+    now[0] = 4
+    assert cache.get("a") == 1
+
+    now[0] = 5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_token_verifier_caches_valid_tokens():
+    verifier = auth.TokenVerifier("mysecret")
+    token = signing.dumps({"user_authentication_id": 1}, key="mysecret")
+
+    assert verifier.verify(token) == {"user_authentication_id": 1}
+    assert verifier.verify(token) == {"user_authentication_id": 1}
+    assert verifier.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+    with pytest.raises(signing.BadSignature):
+        verifier.verify(token + "x")
+    assert len(verifier.cache) == 1
+
+
+def test_batch_verifier_resolves_every_waiter(loop):
+    verifier = auth.BatchVerifier(auth.TokenVerifier("mysecret"), max_batch_size=3, loop=loop)
+    token = signing.dumps({"user_authentication_id": 1}, key="mysecret")
+
+    coro = asyncio.gather(verifier.verify(token), verifier.verify(token),
+                          verifier.verify(token + "x"), return_exceptions=True)
+    valid1, valid2, invalid = loop.run_until_complete(coro)
+
+    assert valid1 == valid2 == {"user_authentication_id": 1}
+    assert isinstance(invalid, signing.BadSignature)
+
+    # Same token is verified only once per batch
+    assert verifier.stats() == {"size": 1, "hits": 0, "misses": 3, "pending": 0}
@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+from taiga_events import handlers
+from taiga_events import types
+from taiga_events.hub import SubscriptionsHub
+from taiga_events.queues import memory
+
+
+class FakeConnection(object):
+    remote_ip = "127.0.0.1"
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, message, *, key=None):
+        self.written.append(message)
+
+    def close(self):
+        pass
+
+
+class SlowAuth(object):
+    @asyncio.coroutine
+    def verify(self, token):
+        yield from asyncio.sleep(0.01)
+        return {"user_authentication_id": 1}
+
+
+def _handler(hub=None):
+    hub = hub or SubscriptionsHub(memory.EventsQueue())
+    return handlers.ConnectionHandler(FakeConnection(), {}, hub, SlowAuth(), None, set())
+
+
+def test_messages_are_handled_in_order(loop):
+    handler = _handler()
+
+    handler.receive({"cmd": "auth", "data": {"token": "token", "sessionId": "foo"}})
+    handler.receive({"cmd": "subscribe", "routing_key": "changes"})
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+    assert handler.authenticated
+    assert list(handler.subscriptions) == ["changes"]
+
+    loop.run_until_complete(handler.close())
+    assert handler.subscriptions == {}
+
+
+class SlowMemberships(object):
+    @asyncio.coroutine
+    def is_member(self, user_id, project_id):
+        yield from asyncio.sleep(0.01)
+        return True
+
+
+def test_duplicate_subscription_is_ignored(loop):
+    hub = SubscriptionsHub(memory.EventsQueue())
+    handler = _handler(hub)
+    handler.memberships = SlowMemberships()
+    loop.run_until_complete(handler.authenticate({"token": "token", "sessionId": "foo"}))
+
+    routing_key = "changes.project.1.userstories"
+    loop.run_until_complete(asyncio.wait([asyncio.Task(handler.add_subscription(routing_key)),
+                                          asyncio.Task(handler.add_subscription(routing_key))]))
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+    assert list(handler.subscriptions) == [routing_key]
+    assert hub.subscribers_count(routing_key) == 1
+    loop.run_until_complete(handler.close())
+
+
+def test_no_subscription_after_close(loop):
+    handler = _handler()
+    handler.memberships = SlowMemberships()
+    loop.run_until_complete(handler.authenticate({"token": "token", "sessionId": "foo"}))
+
+    pending = asyncio.Task(handler.add_subscription("changes.project.1.userstories"))
+    loop.run_until_complete(handler.close())
+    loop.run_until_complete(pending)
+
+    assert handler.subscriptions == {}
+
+
+class BrokenQueue(object):
+    @asyncio.coroutine
+    def subscribe(self, routing_key, buffer_size=10):
+        raise RuntimeError("upstream unavailable")
+
+
+def test_subscription_reports_subscribe_errors(loop):
+    conn = FakeConnection()
+    subscription = handlers.Subscription(None, "changes", BrokenQueue(), conn)
+
+    loop.run_until_complete(subscription.start())
+    loop.run_until_complete(subscription.stop())
+
+    assert conn.written == ['{"error": "upstream unavailable"}']
+
+
+def test_pattern_subscription_sends_published_routing_key(loop):
+    upstream = memory.EventsQueue()
+    conn = FakeConnection()
+    identity = types.AuthMsg("token", 1, "foo")
+    subscription = handlers.Subscription(identity, "changes.project.1.*",
+                                         SubscriptionsHub(upstream), conn)
+
+    loop.run_until_complete(subscription.start())
+    loop.run_until_complete(asyncio.sleep(0))
+    upstream.publish("changes.project.1.tasks", json.dumps({"pk": 1}))
+    loop.run_until_complete(asyncio.sleep(0.01))
+    loop.run_until_complete(subscription.stop())
+
+    assert [json.loads(f.text) for f in conn.written] == [
+        {"pk": 1, "routing_key": "changes.project.1.tasks"}]
@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+from taiga_events import metrics
+from taiga_events.hub import SubscriptionsHub
+from taiga_events.queues import memory
+
+
+def _drain(queue):
+    messages = []
+    while len(queue):
+        messages.append(queue.get_nowait())
+    return messages
+
+
+def test_coalesce_keeps_latest_message_per_object(loop):
+    upstream = memory.EventsQueue()
+    hub = SubscriptionsHub(upstream, coalesce_window=0.01,
+                           coalesce_keys=["changes.project.*.userstories"])
+    sub = loop.run_until_complete(hub.subscribe("changes.project.1.userstories"))
+    coalesced = metrics.messages_coalesced.value
+
+    for data in [{"pk": 1, "v": 1}, {"pk": 2, "v": 1}, {"pk": 1, "v": 2}, {"v": 3}]:
+        upstream.publish("changes.project.1.userstories", json.dumps(data))
+
+    loop.run_until_complete(asyncio.sleep(0.05))
+    messages = [m.data for m in _drain(sub.queue)]
+
+    assert messages == [{"pk": 2, "v": 1}, {"pk": 1, "v": 2}, {"v": 3}]
+    assert metrics.messages_coalesced.value == coalesced + 1
+
+    loop.run_until_complete(hub.close())
+
+
+def test_coalesce_only_configured_keys(loop):
+    hub = SubscriptionsHub(memory.EventsQueue(), coalesce_window=0.01,
+                           coalesce_keys=["changes.project.*.userstories"])
+    assert hub.coalesce_window_for("changes.project.1.userstories") == 0.01
+    assert hub.coalesce_window_for("changes.project.1.tasks") == 0
+    assert SubscriptionsHub(memory.EventsQueue()).coalesce_window_for("foo") == 0
+
+
+def test_coalesce_keeps_objects_of_each_routing_key(loop):
+    upstream = memory.EventsQueue()
+    hub = SubscriptionsHub(upstream, coalesce_window=0.01)
+    sub = loop.run_until_complete(hub.subscribe("changes.project.1.*"))
+
+    upstream.publish("changes.project.1.tasks", json.dumps({"pk": 1}))
+    upstream.publish("changes.project.1.issues", json.dumps({"pk": 1}))
+
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert [m.routing_key for m in _drain(sub.queue)] == ["changes.project.1.tasks",
+                                                          "changes.project.1.issues"]
+    loop.run_until_complete(hub.close())
+
+
+def test_upstream_is_shared_by_subscribers(loop):
+    upstream = memory.EventsQueue()
+    hub = SubscriptionsHub(upstream)
+
+    first = loop.run_until_complete(hub.subscribe("changes.project.1.tasks"))
+    second = loop.run_until_complete(hub.subscribe("changes.project.1.tasks"))
+    assert hub.upstream_count == 1
+    assert hub.subscribers_count("changes.project.1.tasks") == 2
+
+    # One upstream delivery is fanned out to every subscriber
+    assert upstream.publish("changes.project.1.tasks", json.dumps({"pk": 1})) == 1
+    messages = [loop.run_until_complete(hub.consume_message(sub)) for sub in (first, second)]
+    assert messages[0] is messages[1]
+
+    loop.run_until_complete(hub.close_subscription(first))
+    assert hub.upstream_count == 1
+    assert hub.subscribers_count("changes.project.1.tasks") == 1
+
+    # Last subscriber closes the upstream subscription
+    loop.run_until_complete(hub.close_subscription(second))
+    assert hub.upstream_count == 0
+    assert hub.subscribers_total == 0
+    assert upstream.publish("changes.project.1.tasks", json.dumps({"pk": 2})) == 0
+
+
+def test_concurrent_subscribers_open_one_upstream(loop):
+    upstream = memory.EventsQueue()
+    hub = SubscriptionsHub(upstream)
+
+    tasks = [asyncio.Task(hub.subscribe("changes.project.1.tasks")) for x in range(3)]
+    loop.run_until_complete(asyncio.wait(tasks))
+
+    assert hub.upstream_count == 1
+    assert upstream.publish("changes.project.1.tasks", json.dumps({"pk": 1})) == 1
+    loop.run_until_complete(hub.close())
+
+
+class SlowQueue(memory.EventsQueue):
+    @asyncio.coroutine
+    def subscribe(self, routing_key, buffer_size=10):
+        yield from asyncio.sleep(0.01)
+        return (yield from super().subscribe(routing_key, buffer_size))
+
+
+def test_cancelled_subscriber_does_not_cancel_others(loop):
+    upstream = SlowQueue()
+    hub = SubscriptionsHub(upstream)
+
+    first = asyncio.Task(hub.subscribe("changes.foo"))
+    second = asyncio.Task(hub.subscribe("changes.foo"))
+    loop.run_until_complete(asyncio.sleep(0))
+    first.cancel()
+
+    sub = loop.run_until_complete(second)
+    assert first.cancelled()
+    assert hub.subscribers_count("changes.foo") == 1
+
+    assert upstream.publish("changes.foo", json.dumps({"pk": 1})) == 1
+    assert loop.run_until_complete(hub.consume_message(sub)).data == {"pk": 1}
+    loop.run_until_complete(hub.close())
+
+
+def test_upstream_is_closed_when_every_subscriber_is_cancelled(loop):
+    upstream = SlowQueue()
+    hub = SubscriptionsHub(upstream)
+
+    first = asyncio.Task(hub.subscribe("changes.foo"))
+    loop.run_until_complete(asyncio.sleep(0))
+    first.cancel()
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+    assert hub.upstream_count == 0
+    assert upstream.publish("changes.foo", json.dumps({"pk": 1})) == 0
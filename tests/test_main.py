@@ -0,0 +1,100 @@
+import asyncio
+
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("tornado")
+
+from taiga_events import main
+from taiga_events import metrics
+from taiga_events import websocket
+from taiga_events.hub import SubscriptionsHub
+from taiga_events.queues import memory
+
+
+class FakeHandler(object):
+    def __init__(self, connections):
+        self.ws = MagicMock()
+        self.closed = False
+        self.connections = connections
+        self.connections.add(self)
+
+    @asyncio.coroutine
+    def close(self):
+        self.closed = True
+        self.connections.discard(self)
+
+
+def _application(connections):
+    application = MagicMock()
+    application.settings = {
+        "connections": connections,
+        "hub": SubscriptionsHub(memory.EventsQueue()),
+        "tasks": [asyncio.Task(asyncio.sleep(10))],
+        "lag_monitor": MagicMock(),
+        "profiler": None,
+        "repository": MagicMock(),
+        "auth": MagicMock(),
+    }
+    return application
+
+
+def test_drain_app_closes_connections_and_upstream(loop):
+    connections = set()
+    handlers = [FakeHandler(connections) for x in range(5)]
+    application = _application(connections)
+    server = MagicMock()
+
+    hub = application.settings["hub"]
+    loop.run_until_complete(hub.subscribe("changes.foo"))
+
+    loop.run_until_complete(main.drain_app(application, server, window=0.01, tick=0.001))
+
+    server.stop.assert_called_once_with()
+    for handler in handlers:
+        assert handler.closed
+        handler.ws.close.assert_called_once_with(main.SHUTDOWN_CLOSE_CODE, "Reconnect elsewhere")
+    assert connections == set()
+
+    assert hub.upstream_count == 0
+    assert application.settings["tasks"][0].cancelled()
+    application.settings["lag_monitor"].stop.assert_called_once_with()
+    application.settings["repository"].pool.close.assert_called_once_with()
+    application.settings["auth"].close.assert_called_once_with()
+
+
+def test_drain_app_spreads_closes_over_window(loop):
+    connections = set()
+    handlers = [FakeHandler(connections) for x in range(4)]
+    application = _application(connections)
+
+    started_at = loop.time()
+    loop.run_until_complete(main.drain_app(application, MagicMock(), window=0.04, tick=0.01))
+
+    # One connection closed per tick
+    assert loop.time() - started_at >= 0.03
+    assert all(handler.closed for handler in handlers)
+
+
+def test_register_metrics_exposes_auth_pool_and_overflow_stats():
+    verifier = MagicMock()
+    verifier.stats.return_value = {"size": 3, "hits": 7, "misses": 2, "pending": 1}
+    repo = MagicMock()
+    repo.pool.stats.return_value = {"size": 4, "free": 1, "in_use": 3,
+                                    "waiting": 2, "created": 5}
+    hub = SubscriptionsHub(memory.EventsQueue())
+
+    main.register_metrics(hub, set(), verifier=verifier, repo=repo)
+    text = metrics.registry.render()
+
+    assert "taiga_events_auth_cache_hits_total 7\n" in text
+    assert "taiga_events_auth_cache_misses_total 2\n" in text
+    assert "taiga_events_auth_pending_tokens 1\n" in text
+    assert 'taiga_events_repository_connections{state="free"} 1\n' in text
+    assert 'taiga_events_repository_connections{state="in_use"} 3\n' in text
+    assert "taiga_events_repository_waiters 2\n" in text
+    assert "taiga_events_repository_connections_created_total 5\n" in text
+    for policy in websocket.POLICIES:
+        sample = 'taiga_events_outbound_overflows_total{{policy="{0}"}} {1}\n'
+        assert sample.format(policy, websocket.overflow_stats[policy]) in text
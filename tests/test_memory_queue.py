@@ -0,0 +1,19 @@
+import json
+
+from taiga_events.queues import memory
+
+
+def test_publish_routes_to_matching_subscriptions(loop):
+    queue = memory.EventsQueue()
+    exact = loop.run_until_complete(queue.subscribe("changes.project.1.tasks"))
+    pattern = loop.run_until_complete(queue.subscribe("changes.project.1.*"))
+
+    assert queue.publish("changes.project.1.tasks", json.dumps({"pk": 1})) == 2
+    assert queue.publish("changes.project.2.tasks", json.dumps({"pk": 2})) == 0
+
+    msg = loop.run_until_complete(queue.consume_message(exact))
+    assert msg.data == {"pk": 1}
+
+    loop.run_until_complete(queue.close_subscription(exact))
+    assert queue.publish("changes.project.1.tasks", json.dumps({"pk": 3})) == 1
+    assert len(pattern.queue) == 2
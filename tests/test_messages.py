@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from taiga_events.messages import Message
+
+
+def test_message_session_id():
+    msg = Message(json.dumps({"session_id": "abc", "pk": 1}))
+    assert msg.session_id == "abc"
+
+    msg = Message(json.dumps({"pk": 1}))
+    assert msg.session_id is None
+
+
+def test_message_encode_is_cached_per_routing_key():
+    msg = Message(json.dumps({"pk": 1}))
+
+    encoded = msg.encode("changes.project.1.userstories")
+    assert json.loads(encoded) == {"pk": 1, "routing_key": "changes.project.1.userstories"}
+    assert msg.encode("changes.project.1.userstories") is encoded
+
+    # Upstream data is never mutated
+    assert msg.data == {"pk": 1}
+
+
+def test_message_frame_is_shared():
+    msg = Message(json.dumps({"pk": 1}))
+
+    frame = msg.frame("changes.project.1.userstories")
+    assert msg.frame("changes.project.1.userstories") is frame
+
+    data = frame.data
+    text = msg.encode("changes.project.1.userstories").encode("utf-8")
+    assert data[0] == 0x81
+    assert data[1] == len(text)
+    assert data[2:] == text
@@ -0,0 +1,37 @@
+from taiga_events import metrics
+
+
+def test_counter_render():
+    registry = metrics.Registry()
+    counter = registry.counter("test_total", "Test counter.")
+    counter.inc()
+    counter.inc(2)
+
+    text = registry.render()
+    assert "# HELP test_total Test counter.\n" in text
+    assert "# TYPE test_total counter\n" in text
+    assert "test_total 3\n" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    histogram = registry.histogram("test_seconds", "Test histogram.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    text = registry.render()
+    assert 'test_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'test_seconds_bucket{le="1"} 2\n' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3\n' in text
+    assert "test_seconds_count 3\n" in text
+
+
+def test_collector_replaces_previous():
+    registry = metrics.Registry()
+    registry.collector("test_open", "Test gauge.", lambda: [({}, 1)])
+    registry.collector("test_open", "Test gauge.", lambda: [({"backend": "pg"}, 2)])
+
+    text = registry.render()
+    assert text.count("# TYPE test_open gauge") == 1
+    assert 'test_open{backend="pg"} 2\n' in text
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from taiga_events.utils import packing
+
+
+def test_add_str_item_to_packed_map():
+    # {"pk": 1}
+    packed = b"\x81\xa2pk\x01"
+    assert packing.is_map(packed)
+    assert not packing.is_map(json.dumps({"pk": 1}))
+
+    result = packing.add_str_item(packed, "routing_key", "foo")
+    assert result == b"\x82\xa2pk\x01\xabrouting_key\xa3foo"
+
+
+def test_add_str_item_to_large_map():
+    packed = packing.map_header(20) + b"".join(packing.pack_str(str(x)) + b"\x01"
+                                               for x in range(20))
+    result = packing.add_str_item(packed, "routing_key", "foo")
+    assert result[:3] == b"\xde\x00\x15"
+    assert result[3:].startswith(packed[3:])
+
+
+def test_message_pack_passes_through_upstream_payload():
+    msgpack = pytest.importorskip("msgpack")
+
+    from taiga_events.messages import Message
+
+    upstream = msgpack.packb({"pk": 1, "session_id": "abc"}, use_bin_type=True)
+    msg = Message(upstream)
+    assert msg.session_id == "abc"
+
+    packed = msg.pack("changes.foo")
+    assert packed.endswith(upstream[1:] + packing.pack_str("routing_key") +
+                           packing.pack_str("changes.foo"))
+    assert packing.unpackb(packed) == {"pk": 1, "session_id": "abc",
+                                       "routing_key": "changes.foo"}
+
+    # JSON upstream payloads are packed once
+    msg = Message(json.dumps({"pk": 1}))
+    assert packing.unpackb(msg.binary_frame("changes.foo").payload) == {
+        "pk": 1, "routing_key": "changes.foo"}
+    assert msg.binary_frame("changes.foo").data[0] == 0x82
+
+
+def test_message_pack_replaces_upstream_routing_key():
+    msgpack = pytest.importorskip("msgpack")
+
+    from taiga_events.messages import Message
+
+    msg = Message(msgpack.packb({"pk": 1, "routing_key": "changes.bar"}, use_bin_type=True))
+    packed = msg.pack("changes.foo")
+    assert packed[0] == 0x82
+    assert packing.unpackb(packed) == {"pk": 1, "routing_key": "changes.foo"}
+
+
+def test_message_encodes_binary_values_for_json_clients():
+    msgpack = pytest.importorskip("msgpack")
+
+    from taiga_events.messages import Message
+
+    msg = Message(msgpack.packb({"pk": 1, "data": b"\x00\xff"}, use_bin_type=True))
+    assert json.loads(msg.encode("changes.foo")) == {"pk": 1, "data": "AP8=",
+                                                     "routing_key": "changes.foo"}
+
+    # Binary clients receive them as they are
+    assert packing.unpackb(msg.pack("changes.foo"))["data"] == b"\x00\xff"
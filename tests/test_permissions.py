@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from unittest.mock import patch
+
+import pytest
+
+from taiga_events import permissions
+
+
+def test_get_project_id():
+    assert permissions.get_project_id("changes.project.42.userstories") == 42
+    assert permissions.get_project_id("changes") is None
+
+    with pytest.raises(ValueError):
+        permissions.get_project_id("changes.project.foo.userstories")
+
+
+def test_get_project_id_patterns():
+    assert permissions.get_project_id("changes.project.42.*") == 42
+    assert permissions.get_project_id("changes.project.42.#") == 42
+
+    for pattern in ("#", "changes.*", "changes.project.*.userstories", "#.project.42.#"):
+        with pytest.raises(ValueError):
+            permissions.get_project_id(pattern)
+
+
+def test_membership_index_caches_user_projects(loop):
+    calls = []
+
+    @asyncio.coroutine
+    def get_user_project_id_list(repo, user_id):
+        calls.append(user_id)
+        return [1, 2]
+
+    index = permissions.MembershipIndex(None)
+
+    with patch.object(permissions.repo, "get_user_project_id_list", get_user_project_id_list):
+        assert loop.run_until_complete(index.is_member(1, 2))
+        assert not loop.run_until_complete(index.is_member(1, 3))
+        assert calls == [1]
+
+        index.invalidate(1)
+        assert loop.run_until_complete(index.is_member(1, 1))
+        assert calls == [1, 1]
+
+
+def test_membership_invalidated_while_loading_is_not_cached(loop):
+    results = [[1, 2], [1]]
+
+    @asyncio.coroutine
+    def get_user_project_id_list(repo, user_id):
+        yield from asyncio.sleep(0.01)
+        return results.pop(0)
+
+    index = permissions.MembershipIndex(None)
+
+    with patch.object(permissions.repo, "get_user_project_id_list", get_user_project_id_list):
+        loading = asyncio.Task(index.is_member(1, 2))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        # Removed from project 2 while the old memberships are read
+        index.invalidate(1)
+        assert loop.run_until_complete(loading)
+
+        assert not loop.run_until_complete(index.is_member(1, 2))
+        assert results == []
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import socket
+
+from collections import namedtuple
+from unittest.mock import patch
+
+import pytest
+
+from taiga_events.hub import SubscriptionsHub
+from taiga_events.queues import pg
+from taiga_events.utils.ringbuffer import RingBuffer
+
+Notify = namedtuple("Notify", ["channel", "payload"])
+
+
+class FakeCursor(object):
+    def __init__(self, cnn):
+        self.cnn = cnn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    @asyncio.coroutine
+    def execute(self, sql):
+        self.cnn.executed.append(sql)
+        if sql in self.cnn.failing:
+            raise RuntimeError("statement failed")
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.notifies = []
+        self.executed = []
+        self.failing = set()
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def poll(self):
+        if self.closed:
+            raise RuntimeError("connection lost")
+
+        try:
+            self.sock.recv(1024)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.closed = True
+
+    def notify(self, channel, data):
+        self.notifies.append(Notify(channel, json.dumps(data)))
+        self.peer.send(b"x")
+
+
+@pytest.fixture
+def connections(request, loop):
+    connections = []
+
+    @asyncio.coroutine
+    def connect(dsn=None, *, loop=None):
+        cnn = FakeConnection()
+        request.addfinalizer(cnn.sock.close)
+        request.addfinalizer(cnn.peer.close)
+        connections.append(cnn)
+        return cnn
+
+    patcher = patch.object(pg.pg, "connect", connect)
+    patcher.start()
+    request.addfinalizer(patcher.stop)
+    return connections
+
+
+def _drain(queue):
+    messages = []
+    while len(queue):
+        messages.extend(queue.get_nowait())
+    return messages
+
+
+def test_channel_name():
+    assert pg._channel_name("changes.project.1.userstories") == \
+        "events_changes__project__1__userstories"
+
+    for routing_key in ("changes; DROP TABLE foo", "changes.*", "changes-1"):
+        with pytest.raises(ValueError):
+            pg._channel_name(routing_key)
+
+
+def test_invalid_payload_does_not_drop_burst(loop, connections):
+    listener = pg.Listener("dbname=test")
+    queue = RingBuffer(10)
+    loop.run_until_complete(listener.listen("events_foo", queue))
+
+    cnn = connections[0]
+    cnn.notify("events_foo", {"pk": 1})
+    cnn.notifies.append(Notify("events_foo", "not json"))
+    cnn.notify("events_foo", {"pk": 2})
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+    assert [m.data for m in _drain(queue)] == [{"pk": 1}, {"pk": 2}]
+    listener.close()
+
+
+def test_failed_listen_is_undone(loop, connections):
+    listener = pg.Listener("dbname=test")
+    loop.run_until_complete(listener.connect())
+
+    cnn = connections[0]
+    cnn.failing.add("LISTEN events_foo;")
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(listener.listen("events_foo", RingBuffer(10)))
+
+    assert listener.channels == {}
+    assert cnn.executed[-1] == "UNLISTEN events_foo;"
+    listener.close()
+
+
+def test_listen_is_shared_by_channel_subscribers(loop, connections):
+    queues = pg.MultiplexedEventsQueue("dbname=test")
+    first = loop.run_until_complete(queues.subscribe("changes.foo"))
+    second = loop.run_until_complete(queues.subscribe("changes.foo"))
+
+    cnn = connections[0]
+    assert cnn.executed == ["LISTEN events_changes__foo;"]
+
+    cnn.notify("events_changes__foo", {"pk": 1})
+    for sub in (first, second):
+        msg = loop.run_until_complete(queues.consume_message(sub))
+        assert msg.data == {"pk": 1}
+
+    loop.run_until_complete(queues.close_subscription(first))
+    assert cnn.executed == ["LISTEN events_changes__foo;"]
+
+    loop.run_until_complete(queues.close_subscription(second))
+    assert cnn.executed[-1] == "UNLISTEN events_changes__foo;"
+    assert len(connections) == 1
+
+    loop.run_until_complete(queues.close())
+    assert cnn.closed
+
+
+def test_channels_are_listened_again_after_reconnect(loop, connections):
+    queues = pg.MultiplexedEventsQueue("dbname=test")
+    listener = queues.listeners[0]
+    listener.reconnect_delay = 0
+
+    sub = loop.run_until_complete(queues.subscribe("changes.foo"))
+    loop.run_until_complete(queues.subscribe("changes.bar"))
+
+    # Poll fails on a closed connection
+    connections[0].close()
+    connections[0].peer.send(b"x")
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+    assert len(connections) == 2
+    assert listener.cnn is connections[1]
+    assert sorted(connections[1].executed) == ["LISTEN events_changes__bar;",
+                                               "LISTEN events_changes__foo;"]
+
+    connections[1].notify("events_changes__foo", {"pk": 1})
+    msg = loop.run_until_complete(queues.consume_message(sub))
+    assert msg.data == {"pk": 1}
+
+    loop.run_until_complete(queues.close())
+
+
+def test_invalid_routing_key_is_rejected_before_connecting(loop, connections):
+    queues = pg.EventsQueue("dbname=test")
+
+    with pytest.raises(ValueError):
+        loop.run_until_complete(queues.subscribe("changes.user-stories"))
+    assert connections == []
+
+
+def test_invalid_payload_is_skipped_by_subscription(loop, connections):
+    queues = pg.EventsQueue("dbname=test")
+    sub = loop.run_until_complete(queues.subscribe("changes.foo"))
+    loop.run_until_complete(asyncio.sleep(0))
+
+    cnn = connections[0]
+    cnn.notifies.append(Notify("events_changes__foo", "not json"))
+    cnn.notify("events_changes__foo", {"pk": 1})
+
+    msg = loop.run_until_complete(asyncio.wait_for(queues.consume_message(sub), 1))
+    assert msg.data == {"pk": 1}
+    assert cnn.executed == ["LISTEN events_changes__foo;"]
+    sub.rcvloop.cancel()
+
+
+def test_lost_subscription_connection_is_dropped_by_hub(loop, connections):
+    hub = SubscriptionsHub(pg.EventsQueue("dbname=test"))
+    sub = loop.run_until_complete(hub.subscribe("changes.foo"))
+    loop.run_until_complete(asyncio.sleep(0))
+
+    connections[0].close()
+    connections[0].peer.send(b"x")
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(asyncio.wait_for(hub.consume_message(sub), 1))
+    assert hub.upstream_count == 0
@@ -0,0 +1,118 @@
+import asyncio
+
+from unittest.mock import patch
+
+import pytest
+
+from taiga_events.utils import pg
+
+
+class FakeCursor(object):
+    def __init__(self, cnn):
+        self.cnn = cnn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    @asyncio.coroutine
+    def execute(self, sql):
+        yield from asyncio.sleep(0.01)
+        if self.cnn.broken:
+            raise RuntimeError("connection lost")
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return pg.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = True
+
+
+@asyncio.coroutine
+def fake_connect(dsn=None, *, loop=None):
+    return FakeConnection()
+
+
+@pytest.fixture
+def pool(request, loop):
+    patcher = patch.object(pg, "connect", fake_connect)
+    patcher.start()
+    request.addfinalizer(patcher.stop)
+
+    pool = pg.Pool("dbname=test", minsize=0, maxsize=2, acquire_timeout=0.05)
+    request.addfinalizer(pool.close)
+    return pool
+
+
+def test_acquire_times_out_when_exhausted(loop, pool):
+    loop.run_until_complete(pool.acquire())
+    loop.run_until_complete(pool.acquire())
+
+    with pytest.raises(pg.PoolTimeout):
+        loop.run_until_complete(pool.acquire())
+    assert pool.stats()["waiting"] == 0
+
+
+def test_release_wakes_up_waiter(loop, pool):
+    first = loop.run_until_complete(pool.acquire())
+    loop.run_until_complete(pool.acquire())
+
+    waiting = asyncio.Task(pool.acquire())
+    loop.run_until_complete(asyncio.sleep(0))
+    assert pool.stats()["waiting"] == 1
+
+    pool.release(first)
+    assert loop.run_until_complete(waiting) is first
+
+
+def test_size_bounded_during_health_check(loop, pool):
+    pool.health_check_interval = 0
+    cnn = loop.run_until_complete(pool.acquire())
+    pool.release(cnn)
+
+    # The free connection is being checked while
+    # other clients try to acquire connections.
+    checking = asyncio.Task(pool.acquire())
+    loop.run_until_complete(asyncio.sleep(0))
+    assert pool.size == 1
+
+    others = [asyncio.Task(pool.acquire()) for x in range(2)]
+    loop.run_until_complete(asyncio.wait([checking] + others))
+
+    assert pool.stats()["created"] == 2
+    assert pool.size == 2
+    assert len([t for t in others if t.exception() is not None]) == 1
+
+
+def test_broken_connection_is_dropped(loop, pool):
+    pool.health_check_interval = 0
+    cnn = loop.run_until_complete(pool.acquire())
+    pool.release(cnn)
+    cnn.broken = True
+
+    other = loop.run_until_complete(pool.acquire())
+
+    assert cnn.closed
+    assert other is not cnn
+    assert pool.stats() == {"size": 1, "free": 0, "in_use": 1,
+                            "waiting": 0, "created": 2}
+
+
+def test_release_closes_connection_in_transaction(loop, pool):
+    cnn = loop.run_until_complete(pool.acquire())
+    cnn.get_transaction_status = lambda: None
+    pool.release(cnn)
+
+    assert cnn.closed
+    assert pool.size == 0
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from taiga_events import profiling
+
+
+def test_describe_labelled_task(loop):
+    profiler = profiling.LoopProfiler(threshold=0.01, report_interval=0)
+    profiler.install()
+
+    try:
+        @asyncio.coroutine
+        def blocking():
+            time.sleep(0.02)
+
+        task = profiling.label(loop.create_task(blocking()), "subscription foo")
+        loop.run_until_complete(task)
+        loop.call_soon(time.sleep, 0.02)
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        profiler.uninstall()
+
+    origins = [row[0] for row in profiler.report()]
+    assert "subscription foo" in origins
+    assert "time.sleep" in origins
+    assert profiler.slow_callbacks == {}
+
+
+def test_label_is_noop_when_disabled(loop):
+    future = asyncio.Future()
+    profiling.label(future, "foo")
+    assert future not in profiling._origins
+
+
+def test_label_is_formatted_when_enabled(loop):
+    profiler = profiling.LoopProfiler(report_interval=0)
+    profiler.install()
+
+    try:
+        future = asyncio.Future()
+        profiling.label(future, "subscription {0}", "foo")
+        assert profiling._origins[future] == "subscription foo"
+    finally:
+        profiler.uninstall()
+
+
+def test_install_requires_asyncio_handles(loop, monkeypatch):
+    monkeypatch.delattr(asyncio.Handle, "_run")
+    profiler = profiling.LoopProfiler(report_interval=0)
+
+    with pytest.raises(RuntimeError):
+        profiler.install()
+    assert profiling._installed is None
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from taiga_events.queues import base
+from taiga_events.utils.ringbuffer import RingBuffer
+
+
+def test_push_overwrites_oldest_item_when_full(loop):
+    buffer = RingBuffer(2)
+
+    assert buffer.push(1)
+    assert buffer.push(2)
+    assert not buffer.push(3)
+
+    assert len(buffer) == 2
+    assert buffer.dropped == 1
+    assert [buffer.get_nowait(), buffer.get_nowait()] == [2, 3]
+
+    with pytest.raises(IndexError):
+        buffer.get_nowait()
+
+
+def test_put_message_accounts_overflow_by_origin(loop):
+    buffer = RingBuffer(1)
+    overflowed = base.overflow_stats["test"]
+
+    assert base.put_message(buffer, 1, origin="test", routing_key="changes")
+    assert not base.put_message(buffer, 2, origin="test", routing_key="changes")
+    assert base.overflow_stats["test"] == overflowed + 1
+
+
+def test_push_wakes_up_waiting_consumer(loop):
+    buffer = RingBuffer(2)
+    waiting = asyncio.Task(buffer.get())
+
+    loop.run_until_complete(asyncio.sleep(0))
+    assert not waiting.done()
+
+    buffer.push(1)
+    assert loop.run_until_complete(waiting) == 1
+
+
+def test_fail_is_raised_after_remaining_items(loop):
+    buffer = RingBuffer(2)
+    buffer.push(1)
+    buffer.fail(RuntimeError("upstream lost"))
+
+    assert loop.run_until_complete(buffer.get()) == 1
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(buffer.get())
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from taiga_events import signing
+
+
+def test_signature_matches_salted_hmac():
+    signer = signing.Signer("mysecret", salt="salt")
+    expected = signing.base64_hmac("saltsigner", "hello", "mysecret").decode("ascii")
+
+    assert signer.signature("hello") == expected
+    assert signer.signature(b"hello") == expected
+
+
+def test_dumps_loads_roundtrip():
+    token = signing.dumps({"user_authentication_id": 1}, key="mysecret")
+    assert signing.loads(token, key="mysecret") == {"user_authentication_id": 1}
+
+    with pytest.raises(signing.BadSignature):
+        signing.loads(token, key="othersecret")
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from taiga_events.utils.topics import TopicTrie, is_pattern
+
+
+def test_is_pattern():
+    assert is_pattern("changes.project.1.*")
+    assert is_pattern("#")
+    assert not is_pattern("changes.project.1.userstories")
+
+
+def test_topic_trie_match():
+    trie = TopicTrie()
+    trie.add("changes.project.1.userstories", "literal")
+    trie.add("changes.project.1.*", "single")
+    trie.add("changes.project.#", "multiple")
+    trie.add("#", "all")
+    trie.add("changes.*.2.#", "mixed")
+
+    assert trie.match("changes.project.1.userstories") == {"literal", "single", "multiple", "all"}
+    assert trie.match("changes.project.1") == {"multiple", "all"}
+    assert trie.match("changes.project") == {"multiple", "all"}
+    assert trie.match("changes.project.2.tasks.x") == {"multiple", "all", "mixed"}
+    assert trie.match("other") == {"all"}
+
+
+def test_topic_trie_remove_prunes():
+    trie = TopicTrie()
+    trie.add("changes.project.1.*", "a")
+    trie.add("changes.project.1.*", "b")
+    assert len(trie) == 2
+
+    trie.remove("changes.project.1.*", "a")
+    assert trie.match("changes.project.1.tasks") == {"b"}
+
+    trie.remove("changes.project.1.*", "b")
+    trie.remove("changes.project.1.*", "b")
+    assert len(trie) == 0
+    assert trie.match("changes.project.1.tasks") == set()
+    assert trie._root.children == {}
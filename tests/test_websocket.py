@@ -0,0 +1,198 @@
+import asyncio
+import json
+import zlib
+
+from taiga_events import websocket
+from taiga_events.messages import Message
+
+
+class FakeConnection(object):
+    remote_ip = "127.0.0.1"
+    outbound_bytes = 0
+    outbound_messages = 0
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, message, *, key=None):
+        self.written.append(message)
+
+
+def test_batch_writer_sends_one_array_per_tick(loop):
+    conn = FakeConnection()
+    writer = websocket.BatchWriter(conn, max_messages=10)
+
+    writer.write(Message(json.dumps({"pk": 1})).frame("changes.foo"))
+    writer.write(json.dumps({"error": "bar"}))
+    assert conn.written == []
+
+    loop.run_until_complete(asyncio.sleep(0))
+
+    assert len(conn.written) == 1
+    assert json.loads(conn.written[0].text) == [{"pk": 1, "routing_key": "changes.foo"},
+                                               {"error": "bar"}]
+
+
+def test_batch_writer_flushes_on_max_messages(loop):
+    conn = FakeConnection()
+    writer = websocket.BatchWriter(conn, max_delay=10, max_messages=2)
+
+    for x in range(5):
+        writer.write(json.dumps(x))
+
+    assert [json.loads(f.text) for f in conn.written] == [[0, 1], [2, 3]]
+    writer.flush()
+    assert json.loads(conn.written[-1].text) == [4]
+
+
+def test_batch_writer_bundles_binary_frames_in_array(loop):
+    conn = FakeConnection()
+    writer = websocket.BatchWriter(conn, max_messages=10)
+
+    writer.write(websocket.BinaryFrame(b"\x01"))
+    writer.write(websocket.BinaryFrame(b"\x02"))
+    writer.write(json.dumps({"error": "bar"}))
+    writer.flush()
+
+    assert [f.binary for f in conn.written] == [True, False]
+    assert conn.written[0].payload == b"\x92\x01\x02"
+    assert conn.written[0].data == b"\x82\x03\x92\x01\x02"
+
+
+def test_deflated_frame_is_shared_and_valid():
+    text = json.dumps({"pk": 1, "data": "x" * 2000})
+    frame = websocket.Frame(text)
+
+    data = frame.deflated_data()
+    assert frame.deflated_data() is data
+    assert data[0] == 0x80 | websocket.RSV1 | 0x1
+    assert len(data) < len(frame.data)
+
+    # Receivers append the removed tail before inflating
+    payload = data[4:] if data[1] == 126 else data[2:]
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    assert decompressor.decompress(payload + b"\x00\x00\xff\xff").decode("utf-8") == text
+
+
+def test_force_server_no_context_takeover():
+    offer = "permessage-deflate; client_max_window_bits, x-webkit-deflate-frame"
+    assert websocket.force_server_no_context_takeover(offer) == (
+        "permessage-deflate; client_max_window_bits; server_no_context_takeover, "
+        "x-webkit-deflate-frame")
+
+    offer = "permessage-deflate; server_no_context_takeover"
+    assert websocket.force_server_no_context_takeover(offer) == offer
+    assert websocket.force_server_no_context_takeover("foo") == "foo"
+
+
+class FakeHandler(object):
+    def __init__(self):
+        self.writing = True
+        self.written = []
+        self.drain_callback = None
+        self.closed = None
+
+    def is_writing(self):
+        return self.writing
+
+    def on_drain(self, callback):
+        self.drain_callback = callback
+
+    def write_message(self, message):
+        self.written.append(message)
+
+    def write_frame(self, frame):
+        self.written.append(frame.text)
+
+    def close(self, code=None, reason=None):
+        self.closed = code
+
+    def drain(self):
+        self.writing = False
+        callback, self.drain_callback = self.drain_callback, None
+        callback()
+
+
+def test_writes_are_buffered_until_drain():
+    handler = FakeHandler()
+    conn = websocket.WebSocketConnection(handler)
+
+    conn.write("foo")
+    conn.write(websocket.Frame("bar"))
+    assert handler.written == []
+    assert conn.outbound_messages == 2
+    assert conn.outbound_bytes == 3 + len(websocket.Frame("bar").data)
+
+    handler.drain()
+    assert handler.written == ["foo", "bar"]
+    assert conn.outbound_messages == 0
+    assert conn.outbound_bytes == 0
+
+    conn.write("baz")
+    assert handler.written == ["foo", "bar", "baz"]
+
+
+def test_drop_oldest_policy():
+    handler = FakeHandler()
+    conn = websocket.WebSocketConnection(handler, max_messages=2)
+    dropped = websocket.overflow_stats["dropped_messages"]
+
+    for message in ("1", "2", "3", "4"):
+        conn.write(message)
+
+    handler.drain()
+    assert handler.written == ["3", "4"]
+    assert websocket.overflow_stats["dropped_messages"] == dropped + 2
+
+
+def test_byte_limit():
+    handler = FakeHandler()
+    conn = websocket.WebSocketConnection(handler, max_bytes=6, max_messages=None)
+
+    for message in ("aaa", "bbb", "ccc"):
+        conn.write(message)
+
+    assert conn.outbound_bytes == 6
+    handler.drain()
+    assert handler.written == ["bbb", "ccc"]
+
+
+def test_coalesce_policy_keeps_newest_message_per_key():
+    handler = FakeHandler()
+    conn = websocket.WebSocketConnection(handler, max_messages=3,
+                                         policy=websocket.COALESCE)
+
+    conn.write("a1", key="a")
+    conn.write("b1", key="b")
+    conn.write("error")
+    conn.write("a2", key="a")
+
+    handler.drain()
+    assert handler.written == ["b1", "error", "a2"]
+
+
+def test_disconnect_policy():
+    handler = FakeHandler()
+    conn = websocket.WebSocketConnection(handler, max_messages=1,
+                                         policy=websocket.DISCONNECT)
+
+    conn.write("1")
+    conn.write("2")
+
+    assert handler.closed == websocket.SLOW_CONSUMER_CLOSE_CODE
+    assert conn.outbound_messages == 0
+
+
+def test_flush_stops_when_connection_is_closed():
+    handler = FakeHandler()
+    conn = websocket.WebSocketConnection(handler)
+
+    conn.write("1")
+    conn.write("2")
+
+    def write_message(message):
+        raise RuntimeError("connection closed")
+
+    handler.write_message = write_message
+    handler.drain()
+    assert conn.outbound_messages == 0
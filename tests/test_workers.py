@@ -0,0 +1,105 @@
+import os
+import signal
+
+from unittest.mock import patch
+
+import pytest
+
+from taiga_events import workers
+
+
+class FakeProcesses(object):
+    """
+    Stands for os.fork, os.wait and os.kill, running the
+    given steps on every wait call.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.next_pid = 100
+        self.killed = []
+
+    def fork(self):
+        self.next_pid += 1
+        return self.next_pid
+
+    def wait(self):
+        if not self.steps:
+            raise ChildProcessError()
+        return self.steps.pop(0)()
+
+    def kill(self, pid, signum):
+        self.killed.append((pid, signum))
+
+
+def _run(supervisor, processes):
+    with patch.object(os, "fork", processes.fork), \
+            patch.object(os, "wait", processes.wait), \
+            patch.object(os, "kill", processes.kill):
+        previous = (signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT))
+        try:
+            return supervisor.run()
+        finally:
+            signal.signal(signal.SIGTERM, previous[0])
+            signal.signal(signal.SIGINT, previous[1])
+
+
+def test_dead_worker_is_restarted_with_same_id():
+    supervisor = workers.Supervisor(2, None, [])
+    supervisor.min_uptime = 0
+
+    def crash():
+        assert sorted(supervisor.workers) == [101, 102]
+        return 101, 1 << 8
+
+    def stop():
+        assert supervisor.workers[103][0] == 0
+        supervisor._forward_signal(signal.SIGTERM, None)
+        return 102, 0
+
+    processes = FakeProcesses([crash, stop, lambda: (103, 0)])
+    assert _run(supervisor, processes) == 0
+    assert supervisor.workers == {}
+    assert processes.next_pid == 103
+
+
+def test_sigint_is_forwarded_as_sigterm():
+    supervisor = workers.Supervisor(2, None, [])
+
+    def interrupt():
+        supervisor._forward_signal(signal.SIGINT, None)
+        return 101, 0
+
+    processes = FakeProcesses([interrupt, lambda: (102, 0)])
+    _run(supervisor, processes)
+
+    # Workers stopped while stopping are not restarted
+    assert processes.killed == [(101, signal.SIGTERM), (102, signal.SIGTERM)]
+    assert processes.next_pid == 102
+
+
+def test_worker_ignores_sigint():
+    calls = []
+
+    def target(sockets, worker_id):
+        calls.append((sockets, worker_id, signal.getsignal(signal.SIGINT)))
+        return 0
+
+    class Exit(Exception):
+        pass
+
+    def exit(status):
+        raise Exit(status)
+
+    supervisor = workers.Supervisor(1, target, ["socket"])
+    previous = (signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT))
+
+    try:
+        with patch.object(os, "fork", lambda: 0), patch.object(os, "_exit", exit):
+            with pytest.raises(Exit):
+                supervisor._spawn(3)
+    finally:
+        signal.signal(signal.SIGTERM, previous[0])
+        signal.signal(signal.SIGINT, previous[1])
+
+    assert calls == [(["socket"], 3, signal.SIG_IGN)]